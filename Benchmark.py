@@ -0,0 +1,816 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import MIDIconvert
+import MIDIparse
+import SWDgen
+import Trezer
+import TrezerBatch
+import events
+import smd
+from store import get_store
+from utils import midi_parse_bytes
+
+def parse_args():
+    """ creates the parser of the command line
+
+    Returns:
+        Namespace: the values given as arguments in the CLI.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog = "Benchmark",
+        description="Times the conversion steps on synthetic MIDI files."
+    )
+
+    parser.add_argument("suite",help="The benchmark to run.",choices=["parse","notes","pauses","memory","channels","decode","roundtrip","batch","resample"])
+    parser.add_argument("--events",help="The amount of MIDI events of the synthetic file. Defaults to 1000000.",default=1000000,type=int)
+    parser.add_argument("--tracks",help="The amount of tracks of the synthetic file. Defaults to 4.",default=4,type=int)
+    parser.add_argument("--held",help="The amount of notes held at the same time by the notes benchmark. Defaults to 5000.",default=5000,type=int)
+    parser.add_argument("--waits",help="The amount of waits encoded by the pauses benchmark. Defaults to 200000.",default=200000,type=int)
+    parser.add_argument("--per-channel",help="The amount of notes per channel of the channels benchmark. Defaults to 100000.",default=100000,type=int)
+    parser.add_argument("--songs",help="The amount of SMD files decoded by the decode benchmark. Defaults to 200 (about the size of the EoS BGM set).",default=200,type=int)
+    parser.add_argument("--json",help="The file the results of the roundtrip benchmark are written to, as JSON.")
+    parser.add_argument("--baseline",help="The results of a previous roundtrip benchmark (JSON): a stage slower than there fails the benchmark.")
+    parser.add_argument("--tolerance",help="How much slower than the baseline a stage may be, as a fraction. Defaults to 0.25.",default=0.25,type=float)
+    parser.add_argument("--files",help="The amount of MIDI files converted by the batch benchmark. Defaults to 32.",default=32,type=int)
+    parser.add_argument("--latency",help="The time in seconds added to each read of a MIDI file by the batch benchmark, as a network drive would. Defaults to 0.02.",default=0.02,type=float)
+    parser.add_argument("--workers",help="The amount of files converted at the same time by the batch benchmark. Defaults to the amount of CPUs.",default=os.cpu_count(),type=int)
+    parser.add_argument("--queue-depth",help="The amount of MIDI files read ahead by the batch benchmark. Defaults to 4.",default=4,type=int)
+    parser.add_argument("--tpqn",help=f"The ticks per quarter note the resample benchmark converts at. Defaults to {MIDIconvert.SMD_TPQN}.",default=MIDIconvert.SMD_TPQN,type=int)
+    parser.add_argument("--seed",help="The seed used to generate the synthetic file. Defaults to 0.",default=0,type=int)
+    return parser.parse_args()
+
+
+def write_length(value):
+    """ encodes a value as a MIDI variable-length quantity
+    Arguments:
+        value(int): the value to encode
+
+    Returns:
+        bytes: the encoded value
+    """
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.insert(0,(value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(out)
+
+def make_midi(nb_events,nb_tracks=4,seed=0,density=None,tempo_changes=0):
+    """ generates a format 1 MIDI file holding about nb_events events.
+    The notes are spread over every channel of every track, overlap each other,
+    and running status is used whenever possible (as most sequencers do).
+    Arguments:
+        nb_events(int): the amount of events (NoteOn and NoteOff) to generate
+        nb_tracks(int): the amount of tracks to spread the events on
+        seed(int): the seed of the random generator
+        density(float): the average amount of events per quarter note in a track
+        (None for about 3, on quarter note subdivisions)
+        tempo_changes(int): the amount of Set Tempo events added to the first track
+
+    Returns:
+        bytes: the content of the MIDI file
+    """
+    rand = random.Random(seed)
+    tpqn = 480
+    tracks = []
+    per_track = max(2,nb_events // nb_tracks)
+    steps = [0,0,tpqn // 4,tpqn // 2,tpqn]
+    if density is not None:
+        scale = len(steps) * tpqn / density / sum(steps)
+        steps = [round(step * scale) for step in steps]
+    # the events of the first track before which the tempo changes
+    tempo_positions = {per_track * (i + 1) // (tempo_changes + 1) for i in range(tempo_changes)}
+    for trk in range(nb_tracks):
+        body = bytearray()
+        if trk == 0:
+            body += b'\x00\xFF\x51\x03\x07\xA1\x20' # Set Tempo (120 BPM)
+        channel = trk % 16
+        body += bytes([0x00,0xC0 | channel,rand.randrange(128)])
+        held = []
+        last_status = -1
+        events = 0
+        while events < per_track:
+            if trk == 0 and events in tempo_positions:
+                tempo = 60000000 // rand.randrange(60,241)
+                body += b'\x00\xFF\x51\x03' + tempo.to_bytes(3,'big')
+                last_status = -1 # meta events cancel the running status
+            # releasing a note is more likely as more notes are held
+            if held and (rand.random() < len(held) / 8 or per_track - events <= len(held)):
+                key = held.pop(rand.randrange(len(held)))
+                status,data = 0x90 | channel,bytes([key,0]) # NoteOn of velocity 0
+            else:
+                key = rand.randrange(24,108)
+                held.append(key)
+                status,data = 0x90 | channel,bytes([key,rand.randrange(1,128)])
+            body += write_length(rand.choice(steps))
+            if status != last_status:
+                body.append(status)
+                last_status = status
+            body += data
+            events += 1
+        body += b'\x00\xFF\x2F\x00'
+        tracks.append(b'MTrk' + len(body).to_bytes(4,'big') + bytes(body))
+    header = b'MThd' + (6).to_bytes(4,'big') + (1).to_bytes(2,'big') + nb_tracks.to_bytes(2,'big') + tpqn.to_bytes(2,'big')
+    return header + b''.join(tracks)
+
+def make_held_midi(nb_held,seed=0):
+    """ generates a format 0 MIDI file where nb_held notes are pressed
+    before any of them is released. Notes are released in a random order,
+    and the same key is pressed multiple times on a channel.
+    Arguments:
+        nb_held(int): the amount of notes held at the same time
+        seed(int): the seed of the random generator
+
+    Returns:
+        bytes: the content of the MIDI file
+    """
+    rand = random.Random(seed)
+    notes = [(rand.randrange(16),rand.randrange(128)) for _ in range(nb_held)]
+    body = bytearray()
+    for channel,key in notes:
+        body += bytes([0x01,0x90 | channel,key,0x40])
+    rand.shuffle(notes)
+    for channel,key in notes:
+        body += bytes([0x01,0x80 | channel,key,0x40])
+    body += b'\x00\xFF\x2F\x00'
+    header = b'MThd' + (6).to_bytes(4,'big') + (0).to_bytes(2,'big') + (1).to_bytes(2,'big') + (48).to_bytes(2,'big')
+    return header + b'MTrk' + len(body).to_bytes(4,'big') + bytes(body)
+
+
+def scan_bytewise(fd):
+    """ walks through every event of a MIDI file one byte at a time,
+    the way MIDIparse used to read files (one read call per byte).
+    Nothing is stored: it only gives a lower bound of the old reading cost.
+    Arguments:
+        fd(BufferedReader): the file descriptor, right after the MThd magic
+
+    Returns:
+        int: the amount of events read
+    """
+    midi_parse_bytes(fd,4)
+    midi_parse_bytes(fd,2)
+    nb_tracks = midi_parse_bytes(fd,2)
+    midi_parse_bytes(fd,2)
+    events = 0
+    for _ in range(nb_tracks):
+        fd.read(4)
+        midi_parse_bytes(fd,4)
+        last_status = 0
+        while True:
+            byte = 0x80
+            while byte & 0x80:
+                byte = midi_parse_bytes(fd,1)
+            status = midi_parse_bytes(fd,1)
+            events += 1
+            if status == 0xFF:
+                meta_type = midi_parse_bytes(fd,1)
+                length = midi_parse_bytes(fd,1)
+                midi_parse_bytes(fd,length)
+                if meta_type == 0x2F:
+                    break
+                continue
+            if status < 0x80:
+                status = last_status
+            else:
+                midi_parse_bytes(fd,1)
+                last_status = status
+            if (status >> 4) not in (0xC,0xD):
+                midi_parse_bytes(fd,1)
+    return events
+
+def bench_parse(args):
+    """ compares the offset-based parser with a byte-at-a-time reader
+    on a synthetic MIDI file.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    print(f"generating a {args.events} events MIDI file...")
+    data = make_midi(args.events,args.tracks,args.seed)
+    print(f"{len(data)} bytes.")
+
+    start = time.perf_counter()
+    fd = io.BytesIO(data)
+    fd.read(4)
+    events = scan_bytewise(fd)
+    bytewise = time.perf_counter() - start
+    print(f"bytewise read:   {bytewise:8.3f}s {events / bytewise:12.0f} events/s (reading only)")
+
+    start = time.perf_counter()
+    MIDIparse.parse_song(data)
+    parsed = time.perf_counter() - start
+    print(f"MIDIparse:       {parsed:8.3f}s {events / parsed:12.0f} events/s (reading, note matching and sorting)")
+
+def bench_notes(args):
+    """ times the NoteOn/NoteOff matching of MIDIparse on a file
+    holding a lot of notes at the same time, against a linear scan of
+    a list of pending notes (the way notes used to be matched).
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    data = make_held_midi(args.held,args.seed)
+
+    start = time.perf_counter()
+    MIDIparse.parse_song(data)
+    parsed = time.perf_counter() - start
+    print(f"MIDIparse:       {parsed:8.3f}s for {args.held} held notes")
+
+    # same NoteOn/NoteOff sequence, matched by scanning a list
+    rand = random.Random(args.seed)
+    notes = [(rand.randrange(16),rand.randrange(128)) for _ in range(args.held)]
+    start = time.perf_counter()
+    stack = []
+    for clock,(channel,key) in enumerate(notes):
+        stack.append([clock,key,0x40,0,channel])
+    rand.shuffle(notes)
+    for channel,key in notes:
+        for i in stack:
+            if i[1] == key and i[4] == channel:
+                stack.remove(i)
+                break
+    scanned = time.perf_counter() - start
+    print(f"list scan:       {scanned:8.3f}s (matching only)")
+
+def decode_waits(encoded):
+    """ decodes the pause events of each wait with the SMD decoder,
+    one after the other, as the sequencer reads them.
+    Arguments:
+        encoded(list): the pause events of each wait
+
+    Returns:
+        list: the duration waited by the events of each wait
+    """
+    reader = smd.TrackReader()
+    waited = []
+    for data in encoded:
+        start = reader.tick
+        position = 0
+        while position < len(data):
+            position = smd.OPCODES[data[position]](reader,data,position)
+        waited.append(reader.tick - start)
+    return waited
+
+def greedy_pause_size(length,last_pause):
+    """ gives the size of the pause events written by the former encoder
+    (RepeatLastPause or a single Pause8/16/24Bits).
+    Arguments:
+        length(int): the amount of time to wait in ticks
+        last_pause(int): the duration of the last pause made
+
+    Returns:
+        int: the amount of bytes written
+    """
+    if length == 0:
+        return 0
+    if length == last_pause:
+        return 1
+    size = 0
+    while length > 0xFFFFFF:
+        size += 4
+        length -= 0xFFFFFF
+    return size + (2 if length <= 0xFF else 3 if length <= 0xFFFF else 4)
+
+def bench_pauses(args):
+    """ encodes waits typical of MIDI files (quantized on the quarter note
+    subdivisions, some long rests, a few arbitrary values), checks
+    that each sequence of pause events waits exactly the expected time,
+    and compares its size to the former encoder.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    rand = random.Random(args.seed)
+    steps = [2,3,4,6,8,12,16,24,32,48,72,96,144,192]
+    waits = []
+    for _ in range(args.waits):
+        match rand.randrange(10):
+            case 0:
+                waits.append(rand.randrange(1,1 << 26)) # long rests, some above a Pause24Bits
+            case 1 | 2:
+                waits.append(rand.randrange(1,2000))
+            case _:
+                waits.append(sum(rand.choice(steps) for _ in range(rand.randrange(1,4))))
+    MIDIconvert.encode_pause.cache_clear()
+    start = time.perf_counter()
+    encoded = []
+    last_pause = -1
+    for wait in waits:
+        data,last_pause = MIDIconvert.encode_pause(wait,last_pause)
+        encoded.append(data)
+    elapsed = time.perf_counter() - start
+
+    new_size = 0
+    old_size = 0
+    old_last = -1
+    for wait,data,total in zip(waits,encoded,decode_waits(encoded)):
+        if total != wait:
+            print(f"mismatch: {wait} ticks encoded as {data.hex()} ({total} ticks)")
+            sys.exit(1)
+        new_size += len(data)
+        old_size += greedy_pause_size(wait,old_last)
+        old_last = wait
+    print(f"{len(waits)} waits encoded in {elapsed:.3f}s, all decoded to the expected duration.")
+    print(f"former encoder: {old_size:10d} bytes")
+    print(f"encode_pause:   {new_size:10d} bytes ({100 * (old_size - new_size) / old_size:.1f}% smaller)")
+
+def peak_rss():
+    """ gives the peak resident set size of the process, in kilobytes.
+    On Linux, the peak of the process image is read from /proc: the one
+    given by getrusage also counts the parent the process was started from.
+    Returns:
+        int: the peak resident set size
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # given in bytes on macOS
+
+def measure_parse(path,as_lists):
+    """ parses a MIDI file and measures how much the peak memory of the process grew.
+    Meant to be run in a new process: the peak of a process never goes down.
+    Arguments:
+        path(str): the path of the MIDI file
+        as_lists(bool): also holds the instructions as one list of tuples per channel,
+        the way MIDIparse used to before sorting them
+
+    Returns:
+        int: the growth of the peak resident set size, in kilobytes
+        float: the time spent
+    """
+    with MIDIparse.read_midi(path) as data:
+        before = peak_rss()
+        start = time.perf_counter()
+        song = MIDIparse.parse_song(data)
+    if as_lists:
+        tracks = [list(track) for track in song.tracks]
+        for track in tracks:
+            track.sort()
+    elapsed = time.perf_counter() - start
+    return peak_rss() - before,elapsed
+
+def bench_memory(args):
+    """ reports the peak memory used to parse a synthetic MIDI file:
+    the instructions are merged from every track and packed as they are read,
+    compared with holding them all as lists of tuples.
+    Each measure is made in a new process.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    if not os.path.exists("/proc/self/status"):
+        try:
+            import resource
+        except ImportError:
+            print("The memory benchmark cannot read the memory used by a process on this system.")
+            sys.exit(1)
+    print(f"generating a {args.events} events MIDI file...")
+    data = make_midi(args.events,args.tracks,args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory,"bench.mid")
+        with open(path,"wb") as file:
+            file.write(data)
+        print(f"{len(data) / 1024:.0f} KB.")
+        context = multiprocessing.get_context("spawn")
+        for name,as_lists in (("MIDIparse",False),("held as lists",True)):
+            with ProcessPoolExecutor(max_workers=1,mp_context=context) as executor:
+                peak,elapsed = executor.submit(measure_parse,path,as_lists).result()
+            print(f"{name + ':':16} {elapsed:8.3f}s peak RSS +{peak / 1024:8.1f} MB ({peak * 1024 / len(data):.1f}x the file size)")
+
+
+def split_as_lists(song_track,channels):
+    """ orders the instructions of a song by channel the way MIDIparse used to:
+    a sort of one list of tuples per channel, then a scan of every instruction for the end of the song.
+    Arguments:
+        song_track(Track): the instructions of every channel
+        channels(array): the channel of each instruction
+
+    Returns:
+        list: the instructions of each channel
+        int: the time at which the last instruction is finished
+    """
+    tracks = [[] for _ in range(17)]
+    for instruction,channel in zip(song_track,channels):
+        tracks[channel].append(instruction)
+    for track in tracks:
+        track.sort()
+    song_duration = 0
+    for starttime,kind,a,b,value in song_track:
+        if kind == events.PLAY_NOTE:
+            starttime += value
+        song_duration = max(song_duration,starttime)
+    return tracks,song_duration
+
+def bench_channels(args):
+    """ times the step splitting the instructions of a song by channel
+    and finding the end of the song, on a file with a lot of notes per channel.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    # a note is a NoteOn and a NoteOff, each track holds a single channel
+    nb_events = 2 * args.per_channel * args.tracks
+    print(f"generating a {nb_events} events MIDI file ({args.per_channel} notes on each of {args.tracks} channels)...")
+    data = make_midi(nb_events,args.tracks,args.seed)
+    start = time.perf_counter()
+    MIDIparse.parse_song(data)
+    parsed = time.perf_counter() - start
+    print(f"MIDIparse:       {parsed:8.3f}s (whole parse)")
+
+    # the same columns as make_song gathers before splitting them, for the whole song
+    song_track = events.Track(None)
+    channels = array('B')
+    _,tracks = MIDIparse.parse_midi(data)
+    batches = list(MIDIparse.merge_tracks(tracks))
+    for batch in batches:
+        starttimes,kinds,a,b,values,batch_channels = zip(*batch)
+        song_track.extend(starttimes,kinds,a,b,values)
+        channels.extend(batch_channels)
+    numpy = events.numpy
+    results = []
+    if numpy is not None:
+        start = time.perf_counter()
+        split = [events.Track(i) for i in range(17)]
+        events.split_channels(song_track,channels,split)
+        song_duration = song_track.end_time()
+        elapsed = time.perf_counter() - start
+        print(f"columns (numpy): {elapsed:8.3f}s (split and end of the song)")
+        results.append((split,song_duration))
+    # without NumPy, make_song splits each batch as it comes
+    events.numpy = None
+    start = time.perf_counter()
+    split = [events.Track(i) for i in range(17)]
+    for batch in batches:
+        events.split_batch(list(batch),split)
+    song_duration = max(track.end_time() for track in split)
+    elapsed = time.perf_counter() - start
+    events.numpy = numpy
+    print(f"batches (array): {elapsed:8.3f}s (split and end of the song)")
+    results.append((split,song_duration))
+    start = time.perf_counter()
+    tracks,duration = split_as_lists(song_track,channels)
+    elapsed = time.perf_counter() - start
+    print(f"lists of tuples: {elapsed:8.3f}s (split and end of the song)")
+    if any([list(track) for track in split] != tracks or song_duration != duration for split,song_duration in results):
+        print("error: the columns and the lists do not match.")
+        sys.exit(1)
+
+
+def bench_decode(args):
+    """ converts synthetic MIDI files and times the decoding of the SMD files made,
+    the way a whole BGM set would be disassembled.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    print(f"converting {args.songs} synthetic songs...")
+    files = []
+    with contextlib.redirect_stdout(io.StringIO()): # MIDIconvert prints every track
+        for i in range(args.songs):
+            song = MIDIparse.parse_song(make_midi(2000 + i * 10,1 + i % 16,args.seed + i))
+            data,_ = MIDIconvert.convert_song(song,"0000",False)
+            files.append(data)
+    print(f"{sum(len(data) for data in files) / 1024:.0f} KB of SMD files.")
+    start = time.perf_counter()
+    nb_events = 0
+    for data in files:
+        song = smd.decode_smd(data)
+        nb_events += sum(len(track.events) for track in song.tracks)
+    elapsed = time.perf_counter() - start
+    print(f"smd.decode_smd:  {elapsed:8.3f}s {nb_events / elapsed:12.0f} events/s ({nb_events} events)")
+
+
+# the files converted by the roundtrip benchmark: (amount of tracks, events per quarter note, tempo changes)
+ROUNDTRIP_CASES = [(1,2,0),(4,4,8),(16,8,64)]
+
+def check_roundtrip(song,decoded):
+    """ compares the notes, loop points and tempo changes of a song
+    with the ones decoded from its SMD file.
+    Arguments:
+        song(Song): the instructions converted
+        decoded(SMDFile): the SMD file decoded
+
+    Returns:
+        list: a description of each mismatch
+        int: the amount of notes of zero length (written without a duration,
+        the sequencer holds them for the duration of the previous note)
+    """
+    mismatches = []
+    zero_length = 0
+    if len(decoded.tracks) != len(song.tracks):
+        return [f"{len(song.tracks)} tracks converted, {len(decoded.tracks)} decoded"],0
+    for i,(track,smd_track) in enumerate(zip(song.tracks,decoded.tracks)):
+        notes = [(starttime,a,b,value) for starttime,kind,a,b,value in track if kind == events.PLAY_NOTE]
+        smd_notes = [(tick,a,b,value) for tick,kind,a,b,value in smd_track.events if kind == smd.NOTE]
+        if len(notes) != len(smd_notes):
+            mismatches.append(f"track {i}: {len(notes)} notes converted, {len(smd_notes)} decoded")
+        for note,smd_note in zip(notes,smd_notes):
+            if note[3] == 0 and note[:3] == smd_note[:3]:
+                zero_length += 1
+            elif note != smd_note:
+                mismatches.append(f"track {i}: note {note} decoded as {smd_note}")
+        loop_points = [starttime for starttime,kind,_,_,_ in track if kind == events.LOOP_POINT]
+        smd_loop_points = [tick for tick,kind,_,_,_ in smd_track.events if kind == smd.LOOP_POINT]
+        if loop_points != smd_loop_points:
+            mismatches.append(f"track {i}: loop points at {loop_points}, decoded at {smd_loop_points}")
+        tempos = [starttime for starttime,kind,a,_,_ in track if kind == events.META_MESSAGE and a == 0x51]
+        smd_tempos = [tick for tick,kind,_,_,_ in smd_track.events if kind == smd.TEMPO]
+        if tempos != smd_tempos:
+            mismatches.append(f"track {i}: {len(tempos)} tempo changes converted, {len(smd_tempos)} decoded at other times")
+        if smd_track.duration() != song.song_duration:
+            mismatches.append(f"track {i}: ends at {smd_track.duration()} instead of {song.song_duration}")
+    return mismatches,zero_length
+
+def stage_result(elapsed,nb_events,nb_bytes):
+    """ gives the measures of a stage
+    Arguments:
+        elapsed(float): the time spent, in seconds
+        nb_events(int): the amount of events handled
+        nb_bytes(int): the amount of bytes read or written
+
+    Returns:
+        dict: the measures
+    """
+    return {"seconds": elapsed,"events_per_second": nb_events / elapsed,"bytes_per_second": nb_bytes / elapsed}
+
+def roundtrip_case(nb_events,nb_tracks,density,tempo_changes,seed):
+    """ converts a synthetic MIDI file, timing each stage, then decodes the SMD file made.
+    Arguments:
+        nb_events(int): the amount of events (NoteOn and NoteOff) of the file
+        nb_tracks(int): the amount of tracks of the file
+        density(float): the average amount of events per quarter note in a track
+        tempo_changes(int): the amount of Set Tempo events
+        seed(int): the seed of the random generator
+
+    Returns:
+        dict: the parameters, the measures of each stage and the result of the check
+    """
+    data = make_midi(nb_events,nb_tracks,seed,density,tempo_changes)
+    stages = {}
+
+    # reading the MTrk events of every track (parse_mtrk_event)
+    start = time.perf_counter()
+    division,tracks = MIDIparse.parse_midi(data)
+    batches = [list(track) for track in tracks]
+    stages["parse_mtrk_event"] = time.perf_counter() - start
+    # merging the tracks by channel
+    start = time.perf_counter()
+    song = MIDIparse.make_song(division,[iter(track) for track in batches],0)
+    stages["make_song"] = time.perf_counter() - start
+    nb_instructions = sum(len(track) for track in song.tracks)
+
+    # the tracks are made in memory: the chunk lengths are written as each chunk is finished
+    with contextlib.redirect_stdout(io.StringIO()): # MIDIconvert prints every track
+        start = time.perf_counter()
+        smd_data,programs_list = MIDIconvert.convert_song(song,"0000",False)
+        stages["generate_track"] = time.perf_counter() - start
+
+    # the SWD file is made of the presets of the song that were fetched
+    swd_data = None
+    preset_config = MIDIconvert.make_preset_config("0000",programs_list)
+    link_byte,preset_names = SWDgen.check_config(preset_config)
+    store = get_store()
+    preset_names = [name for name in preset_names if store.preset(name) is not None]
+    if len(preset_names) > 0:
+        start = time.perf_counter()
+        prgi_list,wavi_list = SWDgen.load_presets(preset_names,store)
+        swd_data = SWDgen.build_swd(link_byte,prgi_list,wavi_list,store)
+        elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = smd.decode_smd(smd_data)
+    stages["decode_smd"] = time.perf_counter() - start
+    mismatches,zero_length = check_roundtrip(song,decoded)
+
+    measures = {
+        "parse_mtrk_event": stage_result(stages["parse_mtrk_event"],nb_instructions,len(data)),
+        "make_song": stage_result(stages["make_song"],nb_instructions,len(data)),
+        "generate_track": stage_result(stages["generate_track"],nb_instructions,len(smd_data)),
+        # the events of SWDgen are the presets
+        "swdgen": None if swd_data is None else stage_result(elapsed,len(preset_names),len(swd_data)),
+        "decode_smd": stage_result(stages["decode_smd"],nb_instructions,len(smd_data))
+    }
+    return {
+        "tracks": nb_tracks,"density": density,"tempo_changes": tempo_changes,"events": nb_events,
+        "instructions": nb_instructions,"midi_bytes": len(data),"smd_bytes": len(smd_data),
+        "stages": measures,"mismatches": mismatches,"zero_length_notes": zero_length
+    }
+
+def compare_baseline(results,baseline,tolerance):
+    """ compares the time per event of each stage with the one of a previous run.
+    Arguments:
+        results(dict): the results of this run
+        baseline(dict): the results of the previous run
+        tolerance(float): how much slower a stage may be, as a fraction
+
+    Returns:
+        list: a description of each stage slower than the tolerance
+    """
+    regressions = []
+    for case,previous in zip(results["cases"],baseline["cases"]):
+        if (case["tracks"],case["density"],case["tempo_changes"],case["events"]) != \
+                (previous["tracks"],previous["density"],previous["tempo_changes"],previous["events"]):
+            regressions.append("the baseline was not measured on the same files")
+            break
+        for stage,measure in case["stages"].items():
+            before = previous["stages"].get(stage)
+            if measure is None or before is None:
+                continue
+            ratio = before["events_per_second"] / measure["events_per_second"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"{case['tracks']} tracks, {stage}: {ratio:.2f}x slower")
+    return regressions
+
+def git_revision():
+    """ gives the commit of the working tree, to tell the results of each version apart.
+    Returns:
+        str: the hash of the commit (None outside of a git repository)
+    """
+    try:
+        revision = subprocess.run(["git","rev-parse","HEAD"],capture_output=True,text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+    except FileNotFoundError: # git is not installed
+        return None
+    return revision.stdout.strip() if revision.returncode == 0 else None
+
+def bench_roundtrip(args):
+    """ converts synthetic MIDI files of various track counts, densities and
+    tempo changes, times each stage of the conversion, and checks that the notes
+    decoded from the SMD files made match the ones converted.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    results = {
+        "revision": git_revision(),"python": sys.version.split()[0],"numpy": events.numpy is not None,
+        "seed": args.seed,"cases": []
+    }
+    failed = False
+    for nb_tracks,density,tempo_changes in ROUNDTRIP_CASES:
+        case = roundtrip_case(args.events,nb_tracks,density,tempo_changes,args.seed)
+        results["cases"].append(case)
+        print(f"{nb_tracks} tracks, {density} events per quarter note, {tempo_changes} tempo changes:")
+        for stage,measure in case["stages"].items():
+            if measure is None:
+                print(f"  {stage + ':':18} skipped (none of the presets were fetched, see PresetFetcher)")
+            else:
+                print(f"  {stage + ':':18} {measure['seconds']:8.3f}s {measure['events_per_second']:12.0f} events/s {measure['bytes_per_second'] / 1024:10.0f} KB/s")
+        for mismatch in case["mismatches"][:10]:
+            print(f"  mismatch: {mismatch}")
+        if case["zero_length_notes"] > 0:
+            print(f"  {case['zero_length_notes']} notes of zero length (held for the duration of the previous note)")
+        failed |= len(case["mismatches"]) > 0
+    if args.json is not None:
+        with open(args.json,"w") as output:
+            json.dump(results,output,indent=4)
+    if args.baseline is not None:
+        with open(args.baseline,"r") as baseline:
+            regressions = compare_baseline(results,json.load(baseline),args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        failed |= len(regressions) > 0
+    if failed:
+        sys.exit(1)
+
+
+def bench_batch(args):
+    """ converts a batch of synthetic MIDI files, each read with some latency,
+    with a serial loop (read, convert, write, then the next file)
+    and with the pipeline of TrezerBatch, and checks that both write the same files.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    def slow_read(path):
+        time.sleep(args.latency)
+        return TrezerBatch.read_file(path)
+
+    options = Trezer.Options()
+    current_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory) # the files are written in SMDS, the presets are not found
+        try:
+            paths = []
+            for i in range(args.files):
+                paths.append(f"song{i}.mid")
+                with open(paths[-1],"wb") as midi:
+                    midi.write(make_midi(5000 + i * 100,1 + i % 8,args.seed + i))
+
+            start = time.perf_counter()
+            for path in paths:
+                result,files = TrezerBatch.convert_job(path,"serial_" + path[:-4],options,midi_bytes=slow_read(path))
+                TrezerBatch.write_result(result,files)
+            serial = time.perf_counter() - start
+            print(f"serial loop:     {serial:8.3f}s for {args.files} files ({args.latency * 1000:.0f} ms per read)")
+
+            jobs = [(path,"pipeline_" + path[:-4]) for path in paths]
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()): # a line per file
+                results = asyncio.run(TrezerBatch.run_pipeline(jobs,options,args.workers,args.queue_depth,read=slow_read))
+            pipelined = time.perf_counter() - start
+            print(f"pipeline:        {pipelined:8.3f}s ({args.workers} workers, {args.queue_depth} files read ahead, {serial / pipelined:.1f}x)")
+
+            different = []
+            for path in paths:
+                stem = path[:-4]
+                with open(f"SMDS/serial_{stem}/serial_{stem}.smd","rb") as serial_smd, open(f"SMDS/pipeline_{stem}/pipeline_{stem}.smd","rb") as pipeline_smd:
+                    # the date of creation is left out
+                    if serial_smd.read()[0x20:] != pipeline_smd.read()[0x20:]:
+                        different.append(path)
+            failed = [result["midi"] for result in results if result["status"] == "failed"]
+        finally:
+            os.chdir(current_dir)
+    for path in different:
+        print(f"mismatch: {path} was not converted the same way by the pipeline")
+    for path in failed:
+        print(f"failed: {path}")
+    if different or failed:
+        sys.exit(1)
+
+
+def bench_resample(args):
+    """ converts synthetic MIDI files of 480 ticks per quarter note as they are,
+    then resampled with each rounding, and gives the bytes saved and the timing error made.
+    The notes decoded from the SMD files made must match the resampled ones,
+    and no note may lose its duration.
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    failed = False
+    for nb_tracks,density,tempo_changes in ROUNDTRIP_CASES:
+        data = make_midi(args.events,nb_tracks,args.seed,density,tempo_changes)
+        song = MIDIparse.parse_song(data)
+        nb_instructions = sum(len(track) for track in song.tracks)
+        with contextlib.redirect_stdout(io.StringIO()):
+            smd_data,_ = MIDIconvert.convert_song(song,"0000",False)
+        _,zero_length = check_roundtrip(song,smd.decode_smd(smd_data))
+        print(f"{nb_tracks} tracks, {density} events per quarter note ({nb_instructions} instructions):")
+        print(f"  {song.tpqn} ticks:{'':16} {len(smd_data):10} bytes")
+        for rounding in events.ROUNDINGS:
+            numpy = events.numpy
+            paths = [("numpy",numpy),("array",None)] if numpy is not None else [("array",None)]
+            resampled = []
+            for name,module in paths:
+                events.numpy = module
+                start = time.perf_counter()
+                resampled.append(events.resample(song,args.tpqn,rounding))
+                elapsed = time.perf_counter() - start
+                print(f"  resample ({rounding}, {name}):{'':{max(0,12 - len(rounding) - len(name))}} {elapsed:8.3f}s")
+            events.numpy = numpy
+            (resampled_song,error),*others = resampled
+            if any([list(track) for track in resampled_song.tracks] != [list(track) for track in other.tracks] or
+                   resampled_song.song_duration != other.song_duration or error != other_error for other,other_error in others):
+                print("  mismatch: the columns resampled with and without NumPy differ")
+                failed = True
+            with contextlib.redirect_stdout(io.StringIO()):
+                resampled_data,_ = MIDIconvert.convert_song(resampled_song,"0000",False)
+            mismatches,resampled_zero_length = check_roundtrip(resampled_song,smd.decode_smd(resampled_data))
+            saved = len(smd_data) - len(resampled_data)
+            print(f"  {args.tpqn} ticks ({rounding}):{'':{max(0,11 - len(rounding))}} {len(resampled_data):10} bytes, "
+                  f"{saved} saved ({saved / len(smd_data):.1%}), largest error {error:.2f} ticks ({error / song.tpqn:.4f} quarter note)")
+            for mismatch in mismatches[:10]:
+                print(f"  mismatch: {mismatch}")
+            if resampled_zero_length != zero_length:
+                mismatches.append(f"{resampled_zero_length - zero_length} notes lost their duration")
+                print(f"  mismatch: {mismatches[-1]}")
+            failed |= len(mismatches) > 0
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    args = parse_args()
+    match args.suite:
+        case "parse":
+            bench_parse(args)
+        case "notes":
+            bench_notes(args)
+        case "pauses":
+            bench_pauses(args)
+        case "memory":
+            bench_memory(args)
+        case "channels":
+            bench_channels(args)
+        case "decode":
+            bench_decode(args)
+        case "roundtrip":
+            bench_roundtrip(args)
+        case "batch":
+            bench_batch(args)
+        case "resample":
+            bench_resample(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,27 @@
 
 import argparse
+import bisect
+import contextlib
+import heapq
+import math
+import mmap
 import os
 import sys
+from array import array
+from collections import defaultdict,deque
+
+import events
+from events import (AFTERTOUCH,BANK_SELECT,CHANNEL_AFTERTOUCH,CONTROL_CHANGE,INSTR_CHANGE,
+                    LOOP_POINT,META_MESSAGE,PITCH_BEND,PLAY_NOTE,SYSEX,Song,Track,dump_text,split_batch,split_channels,write_song)
+import profiling
+
+# amount of instructions read in a track before the ones that are complete are given
+RELEASE_SIZE = 4096
+# amount of merged instructions split by channel at once
+SPLIT_SIZE = 65536
+# frames per second of the SMPTE formats (29 being 30 drop frame: 29.97 frames per second)
+SMPTE_FRAMES = {24: 24,25: 25,29: 30000 / 1001,30: 30}
 
-from utils import parse_bytes,midi_parse_bytes
 
 def parse_args():
     """ creates the parser of the command line
@@ -14,66 +32,89 @@ def parse_args():
     """
     parser = argparse.ArgumentParser(
         prog = "MIDIparse",
-        description="Takes a MIDI file as input and prints its instructions on a file in the MIDI_TXT directory"
+        description="Takes a MIDI file as input and writes its instructions on a file in the MIDI_TXT directory"
     )
 
     parser.add_argument("midi",help="The path to the MIDI file to parse")
     parser.add_argument("output",help="The name of the file to write")
     parser.add_argument("--loop",help="Makes the song loop at a specific time in ticks(?). Defaults to 0 if unspecified.",default=0,type= (int))
+    parser.add_argument("--text",help="Also writes the instructions as plaintext (in a .txt file next to the output), for debugging.",action="store_true")
+    profiling.add_arguments(parser)
     return parser.parse_args()
 
 
-def parse_header(file_descriptor):
+def parse_header(data):
     """ reads the header chunk in a MIDI file.
-        Currently can only read format 0 and 1 MIDI files
+        MIDI files of format 0, 1 and 2 are read,
+        with a division in ticks per quarter note or in SMPTE frames.
+        A division in SMPTE frames (ticks per frame, and frames per second) counts ticks in seconds:
+        the ticks are kept as is, and given a tempo and a division in ticks per quarter note
+        that last as long. A quarter note lasts about half a second (120 BPM).
     Arguments:
-        file_descriptor(BufferedReader): the file descriptor
+        data(bytes): the content of the MIDI file (or a memory map of it)
     Returns:
-        int: the division value of the track (in beats per quarter note)
+        int: the format of the file
+        int: the amount of tracks in the file
+        int: the division value of the track (in ticks per quarter note)
+        int: the tempo of the file, for a division in SMPTE frames (in microseconds per quarter note).
+            None otherwise: the tempo is given by the Set Tempo events of the file.
+        int: the offset of the first track chunk
     
     """
-    length = midi_parse_bytes(file_descriptor,4)
+    length = int.from_bytes(data[4:8],'big')
     if length != 6:
         print("parse error: the length of the header chunk is different than 6.")
         sys.exit(1)
-    format = midi_parse_bytes(file_descriptor,2)
-    if format == 2:
+    format = int.from_bytes(data[8:10],'big')
+    if format > 2:
         print(f"version error: the MIDI format {format} is not supported")
         sys.exit(1)
-    ntrks = midi_parse_bytes(file_descriptor,2)
-    division = midi_parse_bytes(file_descriptor,2)
-    if division & 0x800 == 0:
-        return ntrks,(division & 0x7FF)
-    else:
-        print("version error: The division value uses a negative SMPTE format which is not supported.")
+    ntrks = int.from_bytes(data[10:12],'big')
+    division = int.from_bytes(data[12:14],'big')
+    if division & 0x8000 == 0:
+        return format,ntrks,(division & 0x7FFF),None,8 + length
+    # the upper byte is the amount of frames per second, negated
+    frames = SMPTE_FRAMES.get(256 - (division >> 8))
+    ticks_per_frame = division & 0xFF
+    if frames is None or ticks_per_frame == 0:
+        print("version error: The division value uses an unknown SMPTE format.")
         sys.exit(1)
-    
-def parse_length(fd):
-    """ reads from the file descriptor length bytes
+    ticks_per_second = frames * ticks_per_frame
+    division = round(ticks_per_second / 2)
+    tempo = round(1000000 * division / ticks_per_second)
+    return format,ntrks,division,tempo,8 + length
+
+def parse_length(data,offset):
+    """ reads a variable-length quantity starting at offset,
     giving the length of bytes to read afterwards
     Arguments:
-        fd(BufferedReader): the file descriptor
+        data(bytes): the content of the MIDI file
+        offset(int): the position of the first byte of the quantity
 
     Returns:
         int: the length read
+        int: the position right after the quantity
 
     """
-    length = 0x0
-    byte = 0xFF
+    byte = data[offset]
+    offset += 1
+    length = byte & 0x7F
     while(byte & 0x80 != 0):
-        byte = midi_parse_bytes(fd,1)
+        byte = data[offset]
+        offset += 1
         length = (length << 7) | (byte & 0x7F)
-    return length
+    return length,offset
 
 def make_play_note(key_note,prepro_stack,channel,master_clock):
     """ Matches a NoteOff with a previously stored NoteOn.
         Adds to the text file a PlayNote instruction,
         with the duration of the note.
+        The oldest NoteOn of the same key and channel is matched first.
         If no previous NoteOn happens to match the NoteOff instruction
         (which shouldn't happen) a warning is printed.
     Arguments:
         key_note(): the NoteOff key value, that matches a NoteOn.
-        prepro_stack(list): A list of all incomplete NoteOn.
+        prepro_stack(dict): all incomplete NoteOn, queued by (channel,key_note).
         channel(int): The channel from which the NoteOff belong.
         master_clock(int): the time (in ticks) at which the NoteOff instruction happens
     Returns:
@@ -82,14 +123,11 @@ def make_play_note(key_note,prepro_stack,channel,master_clock):
         the note hold duration, the channel concerned)
     
     """
-    endtime = master_clock
-    for i in prepro_stack:
-        if i[1] == key_note and i[4] == channel:
-            duration = endtime - i[0]
-            ret = i
-            ret[3] = duration
-            prepro_stack.remove(i)
-            return ret
+    pending = prepro_stack.get((channel,key_note))
+    if pending:
+        ret = pending.popleft()
+        ret[3] = master_clock - ret[0]
+        return ret
     print("warning: A NoteOff has not found its sibling in the processed note list")
 
 
@@ -101,40 +139,37 @@ def add_processed_note(key_note,velocity,channel,master_clock,prepro_stack):
         velocity(): the velocity of the NoteOn instruction.
         channel(int): The channel from which the NoteOn belong.
         master_clock(int): the time (in ticks) at which the NoteOn instruction happens
-        prepro_stack(list): A list of all incomplete NoteOn.
+        prepro_stack(dict): all incomplete NoteOn, queued by (channel,key_note).
     """
     duration = 0
     starttime = master_clock
     note = [starttime,key_note,velocity,duration,channel]
-    prepro_stack.append(note)
+    prepro_stack[(channel,key_note)].append(note)
 
 def make_bank_select(value,channel,master_clock,bank_stack):
     """ Matches a ControlChange(32) with a previously stored ControlChange(0).
         Adds to the text file a BankSelect instruction,
         with the bank value changed.
+        The oldest ControlChange(0) of the channel is matched first.
         If no previous ControlChange(0) happens to match the ControlChange(32) instruction
         (which shouldn't happen) a warning is printed.
     Arguments:
         value(): the ControlChange LSB value.
         channel(int): The channel from which the NoteOff belong.
         master_clock(int): the time (in ticks) at which the ControlChange(32) instruction happens
-        bank_stack(list): A list of all incomplete ControlChange(0).
+        bank_stack(dict): all incomplete ControlChange(0), queued by channel.
     Returns:
         list: a list of datas needed for a PlayNote instrcution
         (namely the start time, the key note, the velocity,
         the note hold duration, the channel concerned)
     
     """
-    endtime = master_clock
-    for i in bank_stack:
-        if i[2] == channel: # hoooopefully that's enough.
-            duration = endtime - i[0]
-            bank_value = (i[1] << 7) + value
-            ret = i
-            ret[2] = bank_value
-            ret[3] = duration
-            bank_stack.remove(i)
-            return ret
+    pending = bank_stack.get(channel)
+    if pending:
+        ret = pending.popleft()
+        ret[2] = (ret[1] << 7) + value
+        ret[3] = master_clock - ret[0]
+        return ret
     print("warning: A Bank Select has not found it's sibling in the processed controller changes.")
 
 def add_bank_select(value,channel,master_clock,bank_stack):
@@ -144,246 +179,366 @@ def add_bank_select(value,channel,master_clock,bank_stack):
         value(): the ControlChange MSB value.
         channel(int): The channel from which the ControlChange belong.
         master_clock(int): the time (in ticks) at which the ControlChange instruction happens
-        bank_stack(list): A list of all incomplete BankSelects.
+        bank_stack(dict): all incomplete ControlChange(0), queued by channel.
     """
     starttime = master_clock
     duration = 0
     bank = [starttime,value,channel,duration]
-    bank_stack.append(bank)
+    bank_stack[channel].append(bank)
+
+def release_instructions(pending,prepro_stack,master_clock):
+    """ Takes out of the pending instructions of a track the ones
+    that no later event of the track can precede.
+    An instruction made later starts at the current time at the earliest,
+    or when the oldest NoteOn still waiting for its NoteOff started.
+    Arguments:
+        pending(list): the instructions made but not given yet (modified in place)
+        prepro_stack(dict): all incomplete NoteOn of the track, queued by (channel,key_note).
+        master_clock(int): the current time (in ticks) in the track
 
-def parse_mtrk_event(fd,midi_channel,prepro_stack,bank_stack):
-    """ reads from the file descriptor an MTrk event
+    Returns:
+        int: the time before which every instruction of the track is released
+        list: the instructions released, sorted
+    """
+    bound = min((notes[0][0] for notes in prepro_stack.values() if notes),default=master_clock)
+    bound = min(bound,master_clock)
+    pending.sort()
+    # the instructions starting before the bound are released
+    cut = bisect.bisect_left(pending,(bound,))
+    released = pending[:cut]
+    del pending[:cut]
+    return bound,released
+
+def parse_mtrk_event(data,offset,start=0,keep_tempo=True):
+    """ reads from the MIDI file content the MTrk events of a track
         It sequentially read first a delta-time and then
-        a corresponding sub-event until the end of file (0xFF2F)
+        a corresponding sub-event until the end of track (0xFF2F)
+        Events are decoded by offset: the file is never read byte per byte.
+        The instructions are given by batches as they are read, sorted by starttime,
+        so that the tracks can be merged without holding the whole song:
+        only the instructions made since the oldest NoteOn still waiting
+        for its NoteOff are kept aside.
+        NoteOn and NoteOff are matched within the track.
     Arguments:
-        fd(BufferedReader): the file descriptor
+        data(bytes): the content of the MIDI file
+        offset(int): the position of the first event of the track
+        start(int): the time (in ticks) at which the track starts
+        keep_tempo(bool): gives the Set Tempo events (dropped when the tempo is given by the header)
+
+    Yields:
+        int: the time before which every instruction of the track was given
+        list: the instructions given, as (starttime, kind, a, b, value, channel)
+        (channel 16 being the tempo channel)
 
     Returns:
-        list(list(string)) -> 16* list string, one for each channel
+        int: the time (in ticks) at which the track ends
     """
+    # NoteOn instructions waiting for their NoteOff, queued by (channel,key_note)
+    prepro_stack = defaultdict(deque)
+    # incomplete BankSelect instructions, queued by channel
+    bank_stack = defaultdict(deque)
+    # instructions read but not given yet
+    pending = []
+    release_size = RELEASE_SIZE
     # Defaults for starttime, last channel used, last MIDI instruction
-    master_clock = 0
+    master_clock = start
     last_channel = 0
-    last_event = "NoteOff"
+    last_event = 0x80
     while(True):
-        # reading the waiting time before the instruction
-        delta_time = parse_length(fd)
+        if len(pending) >= release_size:
+            yield release_instructions(pending,prepro_stack,master_clock)
+            # a NoteOn that is never matched holds back the whole track:
+            # the pending instructions are not sorted over and over again meanwhile
+            release_size = max(RELEASE_SIZE,2 * len(pending))
+        # reading the waiting time before the instruction (most of them fits in a single byte)
+        delta_time = data[offset]
+        offset += 1
+        if delta_time & 0x80:
+            delta_time &= 0x7F
+            byte = 0x80
+            while byte & 0x80:
+                byte = data[offset]
+                offset += 1
+                delta_time = (delta_time << 7) | (byte & 0x7F)
         # advancing master clock
         master_clock += delta_time
         # reading MIDI event
-        event_type = midi_parse_bytes(fd,1)
-        if event_type == 0xFF: # FF -> META-event
-            meta_type = midi_parse_bytes(fd,1)
-            event = ""
-            # the datas of the event should be read as a string
-            string_flag = False
-            match meta_type:
-                case 0x00:
-                    event = "Sequence Number"
-                case 0x01:
-                    event = "Text Event"
-                    string_flag = True
-                case 0x02:
-                    event = "Copyright Notice"
-                    string_flag = True
-                case 0x03:
-                    event = "Track Name"
-                    string_flag = True
-                case 0x04:
-                    event = "Instrument Name"
-                    string_flag = True
-                case 0x05:
-                    event = "Lyric"
-                    string_flag = True
-                case 0x06:
-                    event = "Marker"
-                    string_flag = True
-                case 0x07:
-                    event = "Cue Point"
-                    string_flag = True
-                case 0x20:
-                    event = "MIDI Channel Prefix"
-                case 0x2F: # End of Track
-                    midi_parse_bytes(fd,1) # read 0x00
-                    return midi_channel,prepro_stack,bank_stack
-                case 0x51:
-                    event = "Set Tempo"
-                case 0x54:
-                    event = "SMPTE Offset"
-                case 0x58:
-                    event = "Time Signature"
-                case 0x59:
-                    event = "Key Signature"
-                case 0x7F:
-                    event = "Sequencer Specific Meta-Event"
-                case _:
-                    event = "unknown"
-            meta_length = parse_length(fd)
-            meta_data = midi_parse_bytes(fd,meta_length)
-            if string_flag == True:
-                meta_data = hex(meta_data)
-            # Putting these Meta Event on a separate channel (17th)
-            value = 16 if event == 'Set Tempo' or event == 'Time Signature' or event == 'KeySignature' else 0
-            midi_channel[value].append(f"starttime {master_clock}, MetaMessage, type {event}, data {meta_data}")
-        elif event_type == 0xF0 or event_type == 0xF7: #F0 / F7 -> Sysex-event
-            sysex_length = parse_length(fd)
-            sysex_data = midi_parse_bytes(fd,sysex_length)
-            midi_channel[0].append(f"starttime {master_clock}, Sysex event, data {sysex_data}")
-        elif ((event_type >> 4) == 0x8): # 1000nnnn -> Note Off
-            key_note = midi_parse_bytes(fd,1)
-            velocity = midi_parse_bytes(fd,1)
-            channel = (event_type & 0xF)
-            # Finding NoteOff sibling in the stack
-            play_note = make_play_note(key_note,prepro_stack,channel,master_clock)
-            if play_note is not None:
-                (starttime,key,velocity,duration,channel) = play_note
-            midi_channel[channel].append(f"starttime {starttime}, PlayNote, key_note {key_note}, velocity {velocity}, duration {duration}")
-            last_event = "NoteOff"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) ==0x9): #1001nnnn -> Note On
-            key_note = midi_parse_bytes(fd,1)
-            velocity = midi_parse_bytes(fd,1)
-            channel = (event_type & 0xF)
-            # a NoteOn of velocity 0 is equivalent to a NoteOff.
-            if velocity == 0:
-                play_note= make_play_note(key_note,prepro_stack,channel,master_clock)
+        event_type = data[offset]
+        offset += 1
+        if event_type < 0x80: # 0xxxxxxx -> running status: the byte read is the first parameter of the same event as the last one.
+            status = last_event
+            channel = last_channel
+            first_part = event_type
+        elif event_type < 0xF0:
+            status = event_type & 0xF0
+            channel = event_type & 0xF
+            last_event = status
+            last_channel = channel
+            first_part = data[offset]
+            offset += 1
+        else:
+            status = event_type
+        if status == 0x90: #1001nnnn -> Note On
+            velocity = data[offset]
+            offset += 1
+            if velocity == 0: # a NoteOn of velocity 0 is equivalent to a NoteOff.
+                play_note = make_play_note(first_part,prepro_stack,channel,master_clock)
                 if play_note is not None:
                     (starttime,key,velocity,duration,channel) = play_note
-                midi_channel[channel].append(f"starttime {starttime}, PlayNote, key_note {key_note}, velocity {velocity}, duration {duration}")
-                last_event = "NoteOn"
+                    pending.append((starttime,PLAY_NOTE,first_part,velocity,duration,channel))
             else:
                 # adding the NoteOn to the stack
-                add_processed_note(key_note,velocity,channel,master_clock,prepro_stack)
-                last_event = "NoteOn"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) == 0xA): #1010nnnn -> Aftertouch
-            key_note = midi_parse_bytes(fd,1)
-            velocity = midi_parse_bytes(fd,1)
-            midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, Aftertouch, key_note {key_note}, velocity {velocity}")
-            last_event = "Aftertouch"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) == 0xB): #1011nnnn -> Control Change
-            key_note = midi_parse_bytes(fd,1)
-            velocity = midi_parse_bytes(fd,1)
-            if key_note == 0: # Bank select (MSB)
-                add_bank_select(velocity,(event_type & 0xF),master_clock,bank_stack)
-            elif key_note == 32:#Bank select (LSB)
-                bank = make_bank_select(velocity,(event_type & 0xF),master_clock,bank_stack)
+                add_processed_note(first_part,velocity,channel,master_clock,prepro_stack)
+        elif status == 0x80: # 1000nnnn -> Note Off
+            offset += 1 # NoteOff velocity (unused)
+            # Finding NoteOff sibling in the stack
+            play_note = make_play_note(first_part,prepro_stack,channel,master_clock)
+            if play_note is not None:
+                (starttime,key,velocity,duration,channel) = play_note
+                pending.append((starttime,PLAY_NOTE,first_part,velocity,duration,channel))
+        elif status == 0xB0: #1011nnnn -> Control Change
+            second_part = data[offset]
+            offset += 1
+            if first_part == 0: # Bank select (MSB)
+                add_bank_select(second_part,channel,master_clock,bank_stack)
+            elif first_part == 32:#Bank select (LSB)
+                bank = make_bank_select(second_part,channel,master_clock,bank_stack)
                 if bank is not None:
-                    (starttime,value,channel,duration) = bank
-                midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, BankSelect, bank {value}")
+                    (starttime,value,bank_channel,duration) = bank
+                    pending.append((master_clock,BANK_SELECT,0,0,value,channel))
             else:
-                midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, ControlChange, key_note {key_note}, velocity {velocity}")
-            last_event = "ControlChange"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) == 0xC): #1100nnnn -> Program Change
-            controller_number = parse_bytes(fd,1)
-            midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, InstrChange, controller_number {controller_number}")
-            last_event = "InstrChange"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) == 0xD): #1101nnnn -> channel Aftertouch
-            pressure_value = midi_parse_bytes(fd,1)
-            midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, Channel Aftertouch, pressure_value {pressure_value}")
-            last_event = "Channel Aftertouch"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) == 0xE): #1110nnnn -> Pitch Bend
-            least_bytes = midi_parse_bytes(fd,1)
-            most_bytes = midi_parse_bytes(fd,1)
-            midi_channel[(event_type & 0xF)].append(f"starttime {master_clock}, PitchBend, least_bytes {least_bytes}, most_bytes {most_bytes}")
-            last_event = "PitchBend"
-            last_channel = event_type & 0xF # not sure if event_type is the same after if clause
-        elif ((event_type >> 4) < 0x8): #0xxxnnnn -> after delta-time, bytes with values <= 127 represents the same event as the last one.
-            first_part = event_type
-            match last_event:
-                case "NoteOff":
-                    second_part = midi_parse_bytes(fd,1)
-                    play_note= make_play_note(first_part,prepro_stack,last_channel,master_clock)
-                    if play_note is not None:
-                        (starttime,key,velocity,duration,channel) = play_note
-                        midi_channel[channel].append(f"starttime {starttime}, PlayNote, key_note {first_part}, velocity {velocity}, duration {duration}")
-                case "NoteOn":
-                    second_part = midi_parse_bytes(fd,1)
-                    if second_part == 0:
-                        play_note = make_play_note(first_part,prepro_stack,last_channel,master_clock)
-                        if play_note is not None:
-                            (starttime,key,velocity,duration,channel) = play_note
-                            midi_channel[channel].append(f"starttime {starttime}, PlayNote, key_note {first_part}, velocity {velocity}, duration {duration}")
-                    else:
-                        add_processed_note(first_part,velocity,channel,master_clock,prepro_stack)
-                case "Aftertouch":
-                    second_part = midi_parse_bytes(fd,1)
-                    midi_channel[last_channel].append(f"starttime {master_clock}, Aftertouch, key_note {first_part}, velocity {second_part}")
-                case "ControlChange":
-                    second_part = midi_parse_bytes(fd,1)
-                    if first_part == 0: # Bank select (MSB)
-                        add_bank_select(second_part,last_channel,master_clock,bank_stack)
-                    elif first_part == 32:#Bank select (LSB)
-                        bank = make_bank_select(second_part,last_channel,master_clock,bank_stack)
-                        if bank is not None:
-                            (starttime,value,channel,duration) = bank
-                            midi_channel[last_channel].append(f"starttime {master_clock}, BankSelect, bank {value}")
-                    else:
-                        midi_channel[last_channel].append(f"starttime {master_clock}, ControlChange, key_note {first_part}, velocity {second_part}")
-                case "InstrChange":
-                    midi_channel[last_channel].append(f"starttime {master_clock}, InstrChange, controller_number {first_part}")
-                case "Channel Aftertouch":
-                    midi_channel[last_channel].append(f"starttime {master_clock}, Channel Aftertouch, pressure_value {first_part}")
-                case "PitchBend":
-                    second_part = midi_parse_bytes(fd,1)
-                    midi_channel[last_channel].append(f"starttime {master_clock}, PitchBend, least_bytes {first_part}, most_bytes {second_part}")
+                pending.append((master_clock,CONTROL_CHANGE,first_part,second_part,0,channel))
+        elif status == 0xE0: #1110nnnn -> Pitch Bend
+            second_part = data[offset]
+            offset += 1
+            pending.append((master_clock,PITCH_BEND,first_part,second_part,0,channel))
+        elif status == 0xC0: #1100nnnn -> Program Change
+            pending.append((master_clock,INSTR_CHANGE,first_part,0,0,channel))
+        elif status == 0xA0: #1010nnnn -> Aftertouch
+            second_part = data[offset]
+            offset += 1
+            pending.append((master_clock,AFTERTOUCH,first_part,second_part,0,channel))
+        elif status == 0xD0: #1101nnnn -> channel Aftertouch
+            pending.append((master_clock,CHANNEL_AFTERTOUCH,first_part,0,0,channel))
+        elif status == 0xFF: # FF -> META-event
+            meta_type = data[offset]
+            if meta_type == 0x2F: # End of Track
+                # the NoteOn left without NoteOff are dropped
+                pending.sort()
+                yield math.inf,pending
+                return master_clock
+            meta_length,offset = parse_length(data,offset + 1)
+            # only short datas (tempo, time signature...) are kept
+            meta_data = int.from_bytes(data[offset:offset + meta_length],'big') if meta_length <= 4 else 0
+            offset += meta_length
+            if meta_type == 0x51 and not keep_tempo:
+                continue
+            # Putting the Tempo and Time Signature Meta Event on a separate channel (17th)
+            value = 16 if meta_type == 0x51 or meta_type == 0x58 else 0
+            pending.append((master_clock,META_MESSAGE,meta_type,0,meta_data,value))
+        elif status == 0xF0 or status == 0xF7: #F0 / F7 -> Sysex-event
+            sysex_length,offset = parse_length(data,offset)
+            offset += sysex_length
+            pending.append((master_clock,SYSEX,0,0,sysex_length,0))
         else:
             print("parse error: a bad MIDI event was found.")
             sys.exit(1)
 
 
-def parse_track(file_descriptor,midi_channel,prepro_stack,bank_stack):
-    """ reads from the MIDI file the only track in it (intended for format 0 MIDI files)
+def find_tracks(data,offset,nb_tracks):
+    """ finds the track chunks of the MIDI file content
     Arguments:
-        file_descriptor(BufferedReader): the file descriptor
+        data(bytes): the content of the MIDI file
+        offset(int): the position of the first track chunk
+        nb_tracks(int): the amount of tracks in the file
 
     Returns:
-        int: the int value read in big endian
-    
+        list: the position of the first event of each track
+    """
+    tracks = []
+    for _ in range(nb_tracks):
+        # checking magic number
+        magic = bytes(data[offset:offset + 4])
+        if magic != b'MTrk':
+            print(f"parse error: magic word found is not a MIDI track.\n Found:{magic}")
+            sys.exit(1)
+        length = int.from_bytes(data[offset + 4:offset + 8],'big')
+        tracks.append(offset + 8)
+        # the track length is trusted to find the next chunk, unless it is obviously wrong
+        next_offset = offset + 8 + length
+        if bytes(data[next_offset:next_offset + 4]) != b'MTrk' and len(tracks) < nb_tracks:
+            next_offset = data.find(b'MTrk',offset + 8)
+        offset = next_offset
+    return tracks
+
+
+def chain_sequences(data,offsets,keep_tempo=True):
+    """ reads the tracks of a format 2 MIDI file: each track is a sequence
+    of its own, played once the previous one is finished.
+    The instructions of a sequence all come after the ones of the previous sequences:
+    the tracks are given one after the other, as a single track.
+    Arguments:
+        data(bytes): the content of the MIDI file
+        offsets(list): the position of the first event of each track
+        keep_tempo(bool): gives the Set Tempo events (see parse_mtrk_event)
+
+    Yields:
+        int: the time before which every instruction of the sequences was given
+        list: the instructions given, by sorted batches (see parse_mtrk_event)
+    """
+    start = 0
+    for offset in offsets:
+        sequence = parse_mtrk_event(data,offset,start,keep_tempo)
+        try:
+            while True:
+                bound,batch = next(sequence)
+                if bound == math.inf: # the end of the sequence is the bound of its last batch
+                    last = batch
+                else:
+                    yield bound,batch
+        except StopIteration as end:
+            start = end.value
+        yield start,last
+    yield math.inf,[]
+
+
+@contextlib.contextmanager
+def read_midi(path):
+    """ maps a MIDI file in memory, for the time of a with block.
+    The file is never copied: events are decoded straight from the mapping.
+    The map is closed when the block ends: an open map would keep the file locked on Windows.
+    Arguments:
+        path(str): the path to the MIDI file
+
+    Yields:
+        mmap: a read-only memory map of the file (bytes for an empty file)
     """
-    # checking magic number
-    magic = file_descriptor.read(4)
-    if magic != b'MTrk':
-        print(f"parse error: magic word found is not a MIDI track.\n Found:{magic}")
+    with open(path,"rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def parse_midi(data):
+    """ reads every track of a MIDI file.
+    The sequences of a format 2 file are given one after the other, as a single track.
+    For a division in SMPTE frames, the Set Tempo events are dropped
+    and the tempo given by the header is set at the start of the song.
+    Arguments:
+        data(bytes): the content of the MIDI file (or a memory map of it)
+
+    Returns:
+        int: the division value of the file (in ticks per quarter note)
+        list: the instructions of each track, given by sorted batches (see parse_mtrk_event).
+        The tracks are read as their instructions are needed.
+    """
+    #checking MIDI file magic
+    if bytes(data[:4]) != b'MThd':
+        print("That's not a MIDI file :(")
         sys.exit(1)
-    # length of track (useless)
-    midi_parse_bytes(file_descriptor,4)
-    # reading the track
-    midi_channel,prepro_stack,bank_stack = parse_mtrk_event(file_descriptor,midi_channel,prepro_stack,bank_stack)
-    return midi_channel,prepro_stack,bank_stack
-
-
-def get_max_duration(instruction):
-    """ Finds the time in ticks at which an instruction
-    is finished.
-    The objective is to find the song duration in ticks.
-    Finding the instruction that starts the latest will give us
-    the song duration.
-    PlayNote instruction are not "instantaneous" in time,
-    as they usually hold a note for an amount of time.
+    # reading header chunk
+    format,nb_tracks,division,tempo,offset = parse_header(data)
+    offsets = find_tracks(data,offset,nb_tracks)
+    keep_tempo = tempo is None
+    if format == 2:
+        tracks = [chain_sequences(data,offsets,keep_tempo)]
+    else:
+        tracks = [parse_mtrk_event(data,track,0,keep_tempo) for track in offsets]
+    if tempo is not None: # the tempo given by the header, on the tempo channel
+        tracks.append(iter([(math.inf,[(0,META_MESSAGE,0x51,0,tempo,16)])]))
+    return division,tracks
+
+
+def merge_tracks(tracks):
+    """ merges the instructions of the tracks by starttime.
+    The track given the least far in time is always the one read next
+    (a heap of the tracks is kept, by the time they were given until):
+    every instruction before the earliest of those times is complete, and is given.
     Arguments:
-        instruction(string): a MIDI instruction .
+        tracks(list): the instructions of each track, given by sorted batches with the time
+        before which every instruction of the track was given
+
+    Yields:
+        list: the instructions of every track, by sorted batches
+    """
+    heap = [(0,i) for i in range(len(tracks))]
+    merged = []
+    while heap:
+        _,i = heap[0]
+        try:
+            bound,batch = next(tracks[i])
+        except StopIteration:
+            heapq.heappop(heap)
+            continue
+        heapq.heapreplace(heap,(bound,i))
+        # the batches are sorted runs: sorting them together is a merge
+        merged += batch
+        merged.sort()
+        bound = heap[0][0]
+        cut = len(merged) if bound == math.inf else bisect.bisect_left(merged,(bound,))
+        if cut > 0:
+            yield merged[:cut]
+            del merged[:cut]
+
+def make_song(division,tracks,loop):
+    """ Gathers the instructions of the used channels into tracks.
+    The tempo channel is always the first track, every other track
+    gets a LoopPoint instruction. The instructions are merged by starttime
+    into columns, which are split by channel once SPLIT_SIZE instructions are gathered
+    (without NumPy, each merged batch is split by channel as it comes).
+    Arguments:
+        division(int): the division value of the MIDI file (in ticks per quarter note)
+        tracks(list): the instructions of each MIDI track, given by sorted batches (see parse_mtrk_event)
+        loop(int): the time (in ticks) at which the song loops back
 
     Returns:
-        int: the duration in ticks at which the instruction is finished
-    
+        Song: the song to convert
+    """
+    # 17 tracks: one for each 16 channel + the 17th -> stores Tempo parameters.
+    channel_tracks = [Track(i) for i in range(17)]
+    # Adding a LoopPoint instruction to every channel, the unused ones are dropped afterwards
+    loop_points = [(loop,LOOP_POINT,0,0,0,i) for i in range(16)]
+    merged = Track(None)
+    channels = array('B')
+    song_duration = 0
+    for batch in merge_tracks([*tracks,iter([(math.inf,loop_points)])]):
+        if events.numpy is None: # sorting the tuples is faster than ordering the columns in Python
+            split_batch(batch,channel_tracks)
+            continue
+        starttimes,kinds,a,b,values,batch_channels = zip(*batch)
+        merged.extend(starttimes,kinds,a,b,values)
+        channels.extend(batch_channels)
+        if len(channels) >= SPLIT_SIZE:
+            song_duration = max(song_duration,merged.end_time())
+            split_channels(merged,channels,channel_tracks)
+            merged = Track(None)
+            channels = array('B')
+    if len(channels) > 0:
+        song_duration = max(song_duration,merged.end_time())
+        split_channels(merged,channels,channel_tracks)
+    tracks = [channel_tracks[16]]
+    for track in channel_tracks[:16]:
+        if len(track) > 1: # more than the LoopPoint
+            tracks.append(track)
+    # the song ends when its longest instruction is finished,
+    # the LoopPoints only count when a channel is used
+    if len(tracks) == 1 or events.numpy is None:
+        song_duration = max(track.end_time() for track in tracks)
+    return Song(division,song_duration,tracks)
+
+def parse_song(data,loop=0):
+    """ reads a MIDI file and gives the song to convert
+    Arguments:
+        data(bytes): the content of the MIDI file (or a memory map of it)
+        loop(int): the time (in ticks) at which the song loops back
+
+    Returns:
+        Song: the song to convert
     """
-    # getting starttime value
-    parts = instruction.split(', ')
-    starttime = int(parts[0][10:])
-    match parts[1]:
-        # a PlayNote instruction holds a note for some time
-        # the max duration should takes this time into account
-        case "PlayNote":
-            key_down = int(parts[4][9:])
-        # any other instructions are "instantaneous"
-        case _:
-            key_down = 0
-    return starttime + key_down
+    division,tracks = parse_midi(data)
+    return make_song(division,tracks,loop)
 
 
 def main():
@@ -396,69 +551,28 @@ def main():
     if args.loop < 0:
         print("option error: loop value is negative.")
         sys.exit(1)
-    with open(args.midi,"rb") as file:
-        #checking MIDI file magic
-        magic = file.read(4)
-        if magic != b'MThd':
-            print("That's not a MIDI file :(")
-            sys.exit(1)
-        try:
-            # reading header chunk
-            nb_tracks,division = parse_header(file)
-            # 17 lists: one for each 16 channel + the 17th -> stores Tempo parameters.
-            midi_channel = [ [],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[],[]] 
-            # list storing NoteOn instructions
-            prepro_stack = []
-            #list storing incomplete BankSelect instruction
-            bank_stack = []
-            # reading each tracks of the file
-            for i in range(nb_tracks):
-                midi_channel,prepro_stack,bank_stack = parse_track(file,midi_channel,prepro_stack,bank_stack)
-            # the number of tracks to write back
-            nb_trks = 0
-            # counting how many channels are used
-            for elem in midi_channel:
-                if len(elem)> 0:
-                    nb_trks += 1
-            file_path = f'MIDI_TXT/{args.output}'
-            with open(file_path, "w") as output:
-                output.write(f'ntrks {nb_trks}\n')
-                output.write(f'tpqn {division}\n')
-                song_duration = 0
-                # for all 16 channels: (Tempo channel unaffected)
-                for i in range(16):
-                    list = []
-                    # Adding a LoopPoint instruction to used channels
-                    if len(midi_channel[i]) > 0:
-                        midi_channel[i].append(f'starttime {args.loop}, LoopPoint, ')
-                    # getting all starttime values of the channel
-                    for statements in midi_channel[i]:
-                        parts = statements.split(', ')
-                        starttime_value = int(parts[0][10:])
-                        list.append(starttime_value)
-                    # sorting the channel instruction by starttime order (asc)
-                    ordered_list = zip(list,midi_channel[i])
-                    midi_sorted = [x for _, x in sorted(ordered_list)]
-                    midi_channel[i] = midi_sorted
-                    #getting last instruction of the channel, in order to find the longest time.
-                    if len(midi_channel[i])>0:
-                        song_duration = max(song_duration,get_max_duration(midi_channel[i][-1]))
-                # adding song duration
-                output.write(f'song_duration {song_duration}\n')
-                output.write('\n')
-                # adding "Tempo channel" first
-                for statements in midi_channel[16]:
-                    output.write(statements + '\n')
-                # adding all other channels next.
-                for j in range(16):
-                    if len(midi_channel[j]) != 0:
-                        output.write('\n')
-                        for statements in midi_channel[j]:
-                            output.write(statements + '\n')
-        except Exception as e:
-            print( "an exception has occured:")
-            print(e)
+    profiling.start(args)
+    try:
+        with read_midi(args.midi) as data:
+            with profiling.stage("header",1):
+                division,tracks = parse_midi(data)
+            with profiling.stage("merge") as stage:
+                # the tracks are read as they are merged: each one is timed on its own
+                tracks = [profiling.batches(f"track {i}",track,stage) for i,track in enumerate(tracks)]
+                song = make_song(division,tracks,args.loop)
+                stage.events = sum(len(track) for track in song.tracks)
+        file_path = f'MIDI_TXT/{args.output}'
+        with profiling.stage("write",stage.events):
+            with open(file_path, "wb") as output:
+                write_song(output,song)
+        if args.text:
+            with profiling.stage("text",stage.events):
+                with open(file_path + '.txt', "w") as output:
+                    dump_text(output,song)
+    except Exception as e:
+        print( "an exception has occured:")
+        print(e)
+    profiling.report()
 
 if __name__ == "__main__":
     main()
-
@@ -1,8 +1,18 @@
 import argparse
+import json
 import os
+import struct
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
-from utils import FETCH_SOUNDFONT,FETCH_SOUNDFONT4,parse_bytes,get_padding
+import profiling
+from soundfont import fetched_files,fetched_preset_name
+from store import STORE_PATH,SoundStore,write_store
+from utils import get_padding
+
+# the size and modification time of the BGM files read by the last fetch,
+# with the presets and samples each of them gave
+MANIFEST_PATH = 'PRESETS/fetch_manifest.json'
 
 def parse_args():
     """ creates the parser of the command line
@@ -17,116 +27,182 @@ def parse_args():
     )
 
     parser.add_argument("BGM",help = "The path to the BGM directory.")
+    parser.add_argument("--workers",help = "The amount of BGM files read at the same time. Defaults to the amount of CPUs.",default = os.cpu_count(),type = int)
+    parser.add_argument("--full",help = "Reads every BGM file again, even the ones unchanged since the last fetch.",action = "store_true")
+    profiling.add_arguments(parser)
     return parser.parse_args()
 
-def get_header_slots(file_descriptor):
+def get_header_slots(data):
     """ Reads the header chunk in a SWD file and fetches 
     the prgi and wavi amount in said file.
     Arguments:
-        file_descriptor(BufferedReader): the file descriptor
+        data(bytes): the content of the file
     Returns:
         int: The amount of wavi slots in the file
         int: The amount of prgi slots in the file
+        int: The position of the wavi chunk
     """
-    magic=file_descriptor.read(4) # magic swdl
+    magic = data[0:4] # magic swdl
     if magic != b'swdl':
         print(f'parse error: The magic number read indicates the file is not of .swd format.\n Found:{magic}')
         sys.exit(1)
-    parse_bytes(file_descriptor,66) # unimportant here
-    nb_wavi_slots =parse_bytes(file_descriptor,2)
-    nb_prgi_slots =parse_bytes(file_descriptor,2)
-    parse_bytes(file_descriptor,6) # unimportant as well
-    return nb_wavi_slots,nb_prgi_slots
+    # 66 bytes unimportant here
+    nb_wavi_slots = int.from_bytes(data[70:72],byteorder='little')
+    nb_prgi_slots = int.from_bytes(data[72:74],byteorder='little')
+    # 6 bytes unimportant as well
+    return nb_wavi_slots,nb_prgi_slots,80
+
+def count_slots(data,offset,nb_slots):
+    """ counts the used entries of a pointer table
+    Arguments:
+        data(bytes): the content of the file
+        offset(int): the position of the table
+        nb_slots(int): the amount of entries in the table
 
-def parse_wavi_chunk(fd,wavi_slots,sample_list):
+    Returns:
+        int: the amount of non-zero entries
+    """
+    table = data[offset:offset + 2 * nb_slots]
+    return sum(1 for entry, in struct.iter_unpack('<H',table) if entry != 0)
+
+def parse_wavi_chunk(data,offset,wavi_slots):
     """ Reads the wavi chunk in a SWD file and fetches 
     the samples used in said file.
     Arguments:
-        file_descriptor(BufferedReader): the file descriptor
+        data(bytes): the content of the file
+        offset(int): the position of the wavi chunk
         wavi_slots(int): the amount of samples pointers in the WavTable
-        sample_list(set): the list of samples fetched prior
     Returns:
-        set: The updated sample list
+        list: The (sample ID, data) of the samples
+        int: The position of the prgi chunk
     """
-    magic =fd.read(4) # magic wavi
+    magic = data[offset:offset + 4] # magic wavi
     if magic != b'wavi':
         print(f'parse error: The wavi chunk starts with a wrong magic number.\n Found:{magic}')
         sys.exit(1)
-    parse_bytes(fd,12)# "useless" here
-    cpt = 0
-    for _ in range(wavi_slots):
-        entry = parse_bytes(fd,2)
-        if entry != 0:
-            cpt += 1
-    padding = get_padding(wavi_slots *2,16)
-    parse_bytes(fd,padding)
+    offset += 16 # 12 bytes "useless" here
+    cpt = count_slots(data,offset,wavi_slots)
+    offset += wavi_slots * 2 + get_padding(wavi_slots * 2,16)
+    sample_list = []
     for _ in range(cpt):
-        data = fd.read(64)
-        sample_id = int.from_bytes(data[2:4],byteorder='little')
-        iter = (sample_id,data)
-        sample_list.add(iter)
-    return sample_list
+        sample = data[offset:offset + 64]
+        sample_id = int.from_bytes(sample[2:4],byteorder='little')
+        sample_list.append((sample_id,sample))
+        offset += 64
+    return sample_list,offset
 
-def parse_prgi_chunk(fd,prgi_slots,preset_list,file_number):
+def parse_prgi_chunk(data,offset,prgi_slots,file_number):
     """ Reads the prgi chunk in a SWD file and fetches 
     the presets used in said file.
     Arguments:
-        file_descriptor(BufferedReader): the file descriptor
+        data(bytes): the content of the file
+        offset(int): the position of the prgi chunk
+        prgi_slots(int): the amount of programs pointers in the chunk
         file_number(int): the number in file (bgmXXXX.swd)
-        preset_list(list): the list of presets fetched prior
         
     Returns:
-        list: The updated preset list
+        list: The (name, data) of the presets found in the soundfonts
     """
-    magic =fd.read(4)# magic prgi
+    magic = data[offset:offset + 4]# magic prgi
     if magic != b'prgi':
         print('parse error: The prgi chunk starts with a wrong magic number')
         print(magic)
         sys.exit(1)
-    parse_bytes(fd,12)# "useless" here
-    entries = []
-    cpt = 0
+    offset += 16 # 12 bytes "useless" here
     #programPtrTbl
-    for i in range(prgi_slots):
-        entry = parse_bytes(fd,2)
-        if entry != 0:
-            cpt += 1
-        entries.append(entry)
-    padding = get_padding(prgi_slots *2,16)
-    parse_bytes(fd,padding)
+    cpt = count_slots(data,offset,prgi_slots)
+    offset += prgi_slots * 2 + get_padding(prgi_slots * 2,16)
     #ProramInfoTbl
+    preset_list = []
     for _ in range(cpt):
-        program_id = fd.read(2)
-        splits = fd.read(2)
-        nb_splits = int.from_bytes(splits,byteorder='little',signed=False)
-        prg_volume = fd.read(1)
-        prg_pan = fd.read(1)
-        unknowns = fd.read(5)
-        lfos = fd.read(1)
-        nb_lfos = int.from_bytes(lfos,byteorder='little',signed=False)
-        pad_byte = fd.read(1)
-        something_else = fd.read(3)
-        first_part = program_id + splits + prg_volume + prg_pan + unknowns + lfos + pad_byte + something_else
-        lfos_values = b''
-        splits_values = b''
-        for _ in range(nb_lfos):
-            lfos_values += fd.read(16)
-
-        padding = fd.read(16)# padding bytes (same as pad_byte apparently)
-        for _ in range(nb_splits):
-            splits_values += fd.read(48)
-
-        preset = first_part + lfos_values + padding + splits_values
-        preset_id = int.from_bytes(program_id,byteorder='little',signed=False)
-        key = (file_number,preset_id)
-        instr_name = FETCH_SOUNDFONT.get(key)
-        if instr_name is None:
-            instr_name = FETCH_SOUNDFONT4.get(key)
+        # id(2), splits(2), volume, pan, unknowns(5), lfos, pad byte, something else(3)
+        preset_id = int.from_bytes(data[offset:offset + 2],byteorder='little')
+        nb_splits = int.from_bytes(data[offset + 2:offset + 4],byteorder='little')
+        nb_lfos = data[offset + 11]
+        # the 16 bytes header, the lfos, 16 padding bytes (same as pad byte apparently) and the splits
+        length = 16 + nb_lfos * 16 + 16 + nb_splits * 48
+        preset = data[offset:offset + length]
+        offset += length
+        instr_name = fetched_preset_name(file_number,preset_id)
         if instr_name is not None:
-            iter = (instr_name,preset)
-            preset_list.append(iter)
+            preset_list.append((instr_name,preset))
     return preset_list
 
+def fetch_file(file_name,file_number):
+    """ Reads a SWD file of the BGM directory in one go
+    and fetches its presets and samples.
+    Arguments:
+        file_name(str): the path of the file
+        file_number(int): the number in file (bgmXXXX.swd)
+
+    Returns:
+        list: The (name, data) of the presets
+        list: The (sample ID, data) of the samples
+    """
+    try:
+        with open(file_name, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        print(f'Error: File {file_name} was not found in the directory.')
+        print('A clean version of the BGM directory is recommended.')
+        sys.exit(1)
+    nb_wavi_slots,nb_prgi_slots,offset = get_header_slots(data)
+    sample_list,offset = parse_wavi_chunk(data,offset,nb_wavi_slots)
+    preset_list = parse_prgi_chunk(data,offset,nb_prgi_slots,file_number)
+    return preset_list,sample_list
+
+def read_manifest():
+    """ Reads the manifest written by the previous fetch.
+    Returns:
+        dict: for each BGM file, its size, its modification time
+        and the names/IDs of the presets and samples it gave (empty if there is no manifest)
+    """
+    try:
+        with open(MANIFEST_PATH,'r') as manifest:
+            return json.load(manifest)
+    except (FileNotFoundError,json.JSONDecodeError):
+        return {}
+
+def reuse_previous(entry,stat,store):
+    """ Gives back what a BGM file gave in the previous fetch, if the file did not change.
+    Arguments:
+        entry(dict): the manifest entry of the file (None if the file was never fetched)
+        stat(stat_result): the current status of the file
+        store(SoundStore): the presets and samples fetched previously
+
+    Returns:
+        list: The (name, data) of the presets (None if the file must be read again)
+        list: The (sample ID, data) of the samples
+    """
+    if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+        return None,None
+    preset_list = [(name,store.preset(name)) for name in entry['presets']]
+    sample_list = [(sample_id,store.sample(sample_id)) for sample_id in entry['samples']]
+    if any(data is None for _,data in preset_list + sample_list):
+        return None,None
+    return preset_list,sample_list
+
+def previous_sources(manifest,pick_list):
+    """ Tells which BGM file each preset and sample of the store was taken from
+    (a preset or sample found in many files is taken from the last one).
+    Arguments:
+        manifest(dict): the manifest written by the previous fetch
+        pick_list(list): the numbers of the BGM files fetched
+
+    Returns:
+        dict: the number of the file, by ('PRESETS', name) and ('SAMPLES', sample ID)
+    """
+    sources = {}
+    for i in pick_list:
+        entry = manifest.get(f'bgm{i:04d}.swd')
+        if entry is None:
+            continue
+        for instr_name in entry['presets']:
+            sources['PRESETS',instr_name] = i
+        for sample_id in entry['samples']:
+            sources['SAMPLES',sample_id] = i
+    return sources
+
 def main():
     args = parse_args()
     if not os.path.exists(args.BGM):
@@ -135,47 +211,87 @@ def main():
     if not os.path.isdir(args.BGM):
         print(f'{args.BGM} is not a directory')
         sys.exit(1)
-    sample_list = set()
-    preset_list = []
+    if args.workers < 1:
+        print('option error: at least one worker is needed.')
+        sys.exit(1)
     # pick_list: bgm file numbers needed for fetching
-    pick_list = set()
-    for key in FETCH_SOUNDFONT.keys():
-        filenum  = key[0]
-        if filenum >=0:
-            pick_list.add(filenum)
-    for key in FETCH_SOUNDFONT4.keys():
-        filenum = key[0]
-        if filenum >=0:
-            pick_list.add(filenum)
+    pick_list = fetched_files()
 
     print('Processing...')
-    for i in pick_list:
-        file_number ='0'
-        if i < 100:
-            file_number += '0'
-        if i < 10:
-            file_number += '0'
-        file_number += str(i)
-        file_name = f'{args.BGM}/bgm{file_number}.swd'
-        try:
-            with open(file_name, 'rb') as file:
-                nb_wavi_slots,nb_prgi_slots = get_header_slots(file)
-                sample_list = parse_wavi_chunk(file,nb_wavi_slots,sample_list)
-                preset_list = parse_prgi_chunk(file,nb_prgi_slots,preset_list,i)
-        except FileNotFoundError:
-            print(f'Error: File {file_name} was not found in the directory.')
-            print('A clean version of the BGM directory is recommended.')
-            sys.exit(1)
-    for i in preset_list:
-        instr_name,data = i
-        file_name = f"PRESETS/{instr_name}.bin"
-        with open(file_name,'wb') as output:
-            output.write(data)
-    for j in sample_list:
-        sample_id,data = j
-        file_name = f'SAMPLES/{sample_id}.bin'
-        with open(file_name,'wb') as output:
-            output.write(data)
+    profiling.start(args)
+    with profiling.stage("manifest check",len(pick_list)):
+        manifest = {} if args.full else read_manifest()
+        store = SoundStore(STORE_PATH)
+        results = {} # file number -> (presets, samples)
+        to_fetch = {}
+        new_manifest = {}
+        for i in pick_list:
+            file_name = f'{args.BGM}/bgm{i:04d}.swd'
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                print(f'Error: File {file_name} was not found in the directory.')
+                print('A clean version of the BGM directory is recommended.')
+                sys.exit(1)
+            new_manifest[f'bgm{i:04d}.swd'] = {'size': stat.st_size,'mtime': stat.st_mtime_ns}
+            preset_list,sample_list = reuse_previous(manifest.get(f'bgm{i:04d}.swd'),stat,store)
+            if preset_list is None:
+                to_fetch[i] = file_name
+            else:
+                results[i] = (preset_list,sample_list)
+        # the store only kept the copy of the last file holding a preset or sample:
+        # an unchanged file is read again if that copy comes from a file read again
+        sources = previous_sources(manifest,pick_list)
+        for i,(preset_list,sample_list) in list(results.items()):
+            keys = [('PRESETS',instr_name) for instr_name,_ in preset_list] + [('SAMPLES',sample_id) for sample_id,_ in sample_list]
+            if any(sources[key] in to_fetch for key in keys):
+                del results[i]
+                to_fetch[i] = f'{args.BGM}/bgm{i:04d}.swd'
+
+    if len(to_fetch) > 0:
+        with profiling.stage("BGM files read",len(to_fetch)):
+            with ProcessPoolExecutor(max_workers=min(args.workers,len(to_fetch))) as executor:
+                fetched = executor.map(fetch_file,to_fetch.values(),to_fetch.keys())
+                for i,result in zip(to_fetch,fetched):
+                    results[i] = result
+
+    # the presets and samples of every file, packed in a single file for SWDgen
+    # (a preset or sample found in many files is taken from the last one)
+    with profiling.stage("merge") as stage:
+        presets = {}
+        samples = {}
+        sources = {} # the file each preset and sample was taken from
+        for i in pick_list:
+            preset_list,sample_list = results[i]
+            for instr_name,data in preset_list:
+                presets[instr_name] = data
+                sources['PRESETS',instr_name] = i
+            for sample_id,data in sample_list:
+                samples[sample_id] = data
+                sources['SAMPLES',sample_id] = i
+            entry = new_manifest[f'bgm{i:04d}.swd']
+            entry['presets'] = [instr_name for instr_name,_ in preset_list]
+            entry['samples'] = sorted({sample_id for sample_id,_ in sample_list})
+        stage.events = len(sources)
+    # only the presets and samples of the files read again are written, the other ones did not change
+    with profiling.stage("loose files") as stage:
+        written = 0
+        for (directory,name),i in sources.items():
+            if i in to_fetch:
+                data = presets[name] if directory == 'PRESETS' else samples[name]
+                with open(f'{directory}/{name}.bin','wb') as output:
+                    output.write(data)
+                written += 1
+        stage.events = written
+    if len(to_fetch) > 0 or len(store.presets) == 0:
+        store.close() # a mapped file cannot be replaced on Windows
+        with profiling.stage("store",len(presets) + len(samples)):
+            write_store(STORE_PATH,presets,samples)
+    with profiling.stage("manifest write",len(new_manifest)):
+        with open(MANIFEST_PATH,'w') as manifest_file:
+            json.dump(new_manifest,manifest_file,indent=4)
+    print(f'{len(presets)} presets and {len(samples)} samples were fetched ({len(to_fetch)}/{len(pick_list)} BGM files read).')
+    profiling.report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,10 +1,14 @@
 import argparse
+import io
 import json
 import os
+import struct
 import sys
 from datetime import datetime
 
-from utils import get_padding,parse_bytes
+import profiling
+from store import get_store
+from utils import get_padding
 
 def parse_args():
     """ creates the parser of the command line
@@ -19,6 +23,7 @@ def parse_args():
     )
 
     parser.add_argument("SWD",help="The name of the SMD file that needs an SWD")
+    profiling.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -51,7 +56,7 @@ class KeygroupEntry:
         self.unk51 = unk51
 
 
-def generate_header_chunk(file_descriptor,max_wavi,link_byte):
+def generate_header_chunk(file_descriptor,max_wavi,link_byte,file_length,wavi_length):
     """ Writes the header chunk of the SWD file.
         Most of the header is actually static,
         The date of creation being an exception.
@@ -66,13 +71,15 @@ def generate_header_chunk(file_descriptor,max_wavi,link_byte):
         file_descriptor(BufferedReader): the file descriptor
         max_wavi(int): the highest ID among the samples used.
         link_byte(str): the value of the link bytes
+        file_length(int): the length of the whole file
+        wavi_length(int): the length of the wavi chunk (its header excluded)
 
     """
     first_byte = int(link_byte[:2],base=16)
     second_byte = int(link_byte[2:],base=16)
     file_descriptor.write(b'\x73\x77\x64\x6C') #swdl
     file_descriptor.write(b'\x00\x00\x00\x00') #zeros
-    file_descriptor.write(b'\x00\x00\x00\x00') #file length
+    file_descriptor.write(file_length.to_bytes(4,'little')) #file length
     file_descriptor.write(b'\x15\x04')
     file_descriptor.write(first_byte.to_bytes(1,'little')) # link_byte
     file_descriptor.write(second_byte.to_bytes(1,'little'))
@@ -98,10 +105,10 @@ def generate_header_chunk(file_descriptor,max_wavi,link_byte):
     file_descriptor.write(nb_wavislots.to_bytes(2,'little'))
     file_descriptor.write(nb_prgislots.to_bytes(2,'little'))
     file_descriptor.write(b'\x07\x02')#unknown and maybe unstable
-    file_descriptor.write(b'\x00\x00\x00\x00')#wavi chunk len
+    file_descriptor.write(wavi_length.to_bytes(4,'little'))#wavi chunk len
     return 80 #chunk length
 
-def generate_wavi_chunk(file_descriptor,wavi_list,max_wavi):
+def generate_wavi_chunk(file_descriptor,wavi_list,max_wavi,store):
     """ Writes the wavi chunk of the SWD file.
         the chunk is mostly composed of a pointers table
         and a list of samples. The size of the table varies 
@@ -123,46 +130,47 @@ def generate_wavi_chunk(file_descriptor,wavi_list,max_wavi):
 
         The function declares the address tables, the list of samples with (hopefully)
         the correct offsets for each of them.
+        The table is built in a single pass over the samples, which are all read before being declared.
     Arguments:
         file_descriptor(BufferedReader): the file descriptor
-        wavi_list(list): the list of samples to declare
+        wavi_list(list): the ID's of the samples to declare, in ascending order
         max_wavi(int): the highest ID among the samples used.
+        store(SoundStore): the store holding the samples
 
+    Returns:
+        int: the length of the chunk
     """
+    max_wavi += 1
+    padding = get_padding(2*max_wavi,16)
+    start_address = ((2*max_wavi) + padding)
+    chk_len = start_address + 64 * len(wavi_list)
     file_descriptor.write(b'\x77\x61\x76\x69') #wavi
     file_descriptor.write(b'\x00\x00') #zeros
     file_descriptor.write(b'\x15\x04')
     file_descriptor.write(b'\x10\x00\x00\x00')
-    file_descriptor.write(b'\x00\x00\x00\x00')#chunk length
-    chk_len = 1# offset of 1 for length
-    max_wavi += 1
-    padding = get_padding(2*max_wavi,16)
-    start_address = ((2*max_wavi) + padding)
-    for i in range(max_wavi):
-        if i in wavi_list:
-            pointer = start_address
-            file_descriptor.write(int.to_bytes(pointer,2,'little'))
-            start_address += 64 # all(?) samples declarations are 64 bytes long
-        else:
-            file_descriptor.write(b'\x00\x00') # sample ID unused
-
-    chk_len += (padding + 2*(max_wavi))
-    for _ in range(padding):
-        file_descriptor.write(b'\xAA')
+    file_descriptor.write(chk_len.to_bytes(4,'little'))#chunk length
+    # the pointers table: the samples are declared in ascending order of their ID
+    table = bytearray(start_address)
+    for i,sample_id in enumerate(wavi_list):
+        struct.pack_into('<H',table,2 * sample_id,start_address + 64 * i) # all(?) samples declarations are 64 bytes long
+    table[2*max_wavi:] = b'\xAA' * padding
+    file_descriptor.write(table)
+    samples = [store.sample(sample_id) for sample_id in wavi_list]
+    missing = [sample_id for sample_id,datas in zip(wavi_list,samples) if datas is None]
+    if len(missing) > 0:
+        print(f'Sample error: The samples {", ".join(map(str,missing))} were not found in the SAMPLES directory.')
+        print('If you know the sample should exist, try and run PresetFetcher with a clean BGM directory.')
+        sys.exit(1)
+    declarations = bytearray()
     smplpos = 0# sample position in memory (starts at 0)
-    chk_len += (64 * len(wavi_list))
-    for j in range(len(wavi_list)):
-        with open(f"SAMPLES/{wavi_list[j]}.bin","rb") as wavi:
-            datas = wavi.read()
-        loopbeg = int.from_bytes(datas[40:44],byteorder='little')
-        looplen = int.from_bytes(datas[44:48],byteorder='little')
-        incr = ((loopbeg+looplen)*4)# "length" of the sample
-        
-        file_descriptor.write(datas[:36])
-        file_descriptor.write(smplpos.to_bytes(4,'little'))
-        file_descriptor.write(datas[40:64])
-        smplpos += incr # updated position in memory for the next sample.
-    return 15 + chk_len #wavi chunk length (chk_len, with its +1 offset plus 15 bytes written prior, actually 16)
+    for datas in samples:
+        loopbeg,looplen = struct.unpack_from('<II',datas,40)
+        declarations += datas[:36]
+        declarations += smplpos.to_bytes(4,'little')
+        declarations += datas[40:64]
+        smplpos += (loopbeg+looplen)*4 # "length" of the sample, updated position in memory for the next sample.
+    file_descriptor.write(declarations)
+    return 16 + chk_len #wavi chunk length, its header included
 
 def generate_prgi_chunk(file_descriptor,prgi_list):
     """ Writes the prgi chunk of the SWD file.
@@ -189,13 +197,15 @@ def generate_prgi_chunk(file_descriptor,prgi_list):
         file_descriptor(BufferedReader): the file descriptor
         prgi_list(list): the list of presets to declare
 
+    Returns:
+        int: the length of the chunk
     """
+    chk_len = 256 + sum(preset.len for preset in prgi_list)
     file_descriptor.write(b'\x70\x72\x67\x69') #prgi
     file_descriptor.write(b'\x00\x00') #zeros
     file_descriptor.write(b'\x15\x04')
     file_descriptor.write(b'\x10\x00\x00\x00')
-    file_descriptor.write(b'\x00\x00\x00\x00')#chunk length
-    chk_len = 1# offset of 1 for length
+    file_descriptor.write(chk_len.to_bytes(4,'little'))#chunk length
     prgi_slots = 128 # fixed for PMD soundfont apparently
     start_address = 256 # same
     for i in range(prgi_slots):
@@ -206,14 +216,12 @@ def generate_prgi_chunk(file_descriptor,prgi_list):
         else:
             file_descriptor.write(b'\x00\x00')
     #No padding since prgi_slots is 128 (already aligned with 16)
-    chk_len += 256
 
     for k in range(len(prgi_list)):
         file_descriptor.write(k.to_bytes(1,'little')) # preset ID
         file_descriptor.write(prgi_list[k].data) # preset data
-        chk_len += prgi_list[k].len
 
-    return 15 + chk_len #wavi chunk length (chk_len, with its +1 offset plus 15 bytes written prior, actually 16)
+    return 16 + chk_len #prgi chunk length, its header included
 
 def generate_kgrp_chunk(file_descriptor,kgrp_list):
     """ Writes the kgrp chunk of the SMD file.
@@ -230,13 +238,15 @@ def generate_kgrp_chunk(file_descriptor,kgrp_list):
         file_descriptor(BufferedReader): the file descriptor
         kgrp_list(list): the list of keygroups to declare
 
+    Returns:
+        int: the length of the chunk
     """
+    chk_len = 8* len(kgrp_list) # the padding is not counted in the chunk length
     file_descriptor.write(b'\x6B\x67\x72\x70') #kgrp
     file_descriptor.write(b'\x00\x00') #zeros
     file_descriptor.write(b'\x15\x04')
     file_descriptor.write(b'\x10\x00\x00\x00')
-    file_descriptor.write(b'\x00\x00\x00\x00')#chunk length
-    chk_len = 0 #no offset added yet, padding necessary
+    file_descriptor.write(chk_len.to_bytes(4,'little'))#chunk length
     for i in kgrp_list:
         file_descriptor.write(i.id)# Actually have no idea how this works
         file_descriptor.write(i.poly)# Actually have no idea how this works
@@ -245,12 +255,9 @@ def generate_kgrp_chunk(file_descriptor,kgrp_list):
         file_descriptor.write(i.vchigh)# Actually have no idea how this works
         file_descriptor.write(i.unk50)# Actually have no idea how this works
         file_descriptor.write(i.unk51)# Actually have no idea how this works
-    chk_len += 8* len(kgrp_list)
     padding = get_padding(chk_len,16)
-    for _ in range(padding):
-        file_descriptor.write(b'\xFF')# the actual values varies between files and might be garbage, or not (we don't know?)
-    chk_len += 1 #offset that was not added prior
-    return 15 + chk_len,padding
+    file_descriptor.write(b'\xFF' * padding)# the actual values varies between files and might be garbage, or not (we don't know?)
+    return 16 + chk_len + padding #kgrp chunk length, its header and padding included
 
 def generate_pcmd_chunk():
     print('pcmd chunks are not present in .swd files of EoS. This function is therefore unimplemented')
@@ -266,70 +273,71 @@ def generate_eod_chunk(file_descriptor):
     file_descriptor.write(b'\x10\x00\x00\x00')
     file_descriptor.write(b'\x00\x00\x00\x00')# *actual* chunk length
     return 16
-def main():
-    args = parse_args()
-    dir_path = f"SMDS/{args.SWD}"
-    json_path = dir_path + '/preset_output.json'
-    if not os.path.exists(json_path):
-        print(f"Configuration file {json_path} is not found")
-        sys.exit(1)
+def missing_preset_hint(name):
+    """ Explains why a preset may be missing, by looking its name up in the soundfont tables.
+    Arguments:
+        name(str): the name of the preset
 
-    with open(json_path,'r') as data:
-        configs = json.load(data)
-    link_byte = configs['link_byte']
-    if len(link_byte) != 4:
-        print("config error: link byte is not of length 4")
-        sys.exit(1)
-    try:
-        link_byte = str.encode(link_byte)
-    except Exception as e:
-        print("hex function failure")
-        print(e)
-        sys.exit(1)
-    preset_list = []
-    for preset in configs['presets']:
-        preset_name = preset['name']
-        preset_list.append(preset_name)
+    Returns:
+        str: the explanation
+    """
+    # the tables are only loaded when a preset is missing
+    from soundfont import find_fetched_preset,find_gm_program,find_pmd_program
+    fetched = find_fetched_preset(name)
+    if fetched is not None:
+        return f'It is fetched from bgm{fetched[0]:04d}.swd: try and run PresetFetcher with a clean BGM directory.'
+    program = find_pmd_program(name)
+    if program is not None:
+        bank,program = program
+        return f'It is the program {program} of the bank {bank} of the PMD soundfont, which is currently unavailable.'
+    if find_gm_program(name) is not None:
+        return 'It is the name of a General MIDI program: replace it by a preset of the PMD soundfont (or convert with --pmd-soundfont).'
+    return 'It is not the name of a preset of the PMD soundfont.'
+
+def load_presets(preset_names,store):
+    """ Reads the presets from the store, and lists the samples they use.
+    Arguments:
+        preset_names(list): the names of the presets, in order of their ID
+        store(SoundStore): the store holding the presets
+
+    Returns:
+        list: the presets read (None if one of them could not be read)
+        list: the ID's of the samples used by the presets
+    """
     prgi_list = [] 
-    wavi_list = []
-    print('Processing...')
-    for elem in preset_list:
-        file_path = f'PRESETS/{elem}.bin'
-        try:
-            with open(file_path,"rb") as preset:
-                preset.read(1) # removing preset ID
-                datas = preset.read() # reading datas
-                data_len = len(datas)
-                iter = Preset(datas,data_len)
-                prgi_list.append(iter)
-                fetcher = 113 # the ID of samples can be found starting from here.
-                if data_len < 143: # all preset should be at least 144 (-1 here, we removed the ID)
-                    print(f"Preset error: for some reason, preset {elem} is under 144 bytes long.")
-                    sys.exit(1)
-                data_len -= 143 # After reading the first sample, 143 bytes will be read
-                while True:
-                    sample = int.from_bytes(datas[fetcher:(fetcher+2)],'little') # reading a sample
-                    wavi_list.append(sample) if sample not in wavi_list else wavi_list # adding it to the list if not already in it
-                    if data_len == 0: # reached the end of the preset
-                        break
-                    if data_len < 0: # Samples used by the presets all are 48 bytes long. It should be impossible to reach a negative length here
-                        print(f"Preset error: for some reason, preset {elem} does not hold a correct format:")
-                        print("a sample declaration has a size different of 48 bytes.")
-                        sys.exit(1)
-                    else:
-                        data_len -= 48 # after reading the sample ID, the next one is 48 bytes afterwards
-                        fetcher += 48 # we change the fetcher right on the next sample ID
-        except FileNotFoundError:
+    wavi_list = {} # the samples used, as the keys of a dict: each one is kept once, in order of use
+    for elem in preset_names:
+        preset = store.preset(elem)
+        if preset is None:
             print(f'Preset error: The preset {elem} was not found in the PRESETS directory.')
-            print('It is very likely that this preset is currently unavailable.')
-            print('If you know the preset should exist, try and run PresetFetcher with a clean BGM directory.')
+            print(missing_preset_hint(elem))
             print('')
-
-    if len(prgi_list) != len(preset_list):
+            continue
+        datas = preset[1:] # removing preset ID
+        data_len = len(datas)
+        iter = Preset(datas,data_len)
+        prgi_list.append(iter)
+        fetcher = 113 # the ID of samples can be found starting from here.
+        if data_len < 143: # all preset should be at least 144 (-1 here, we removed the ID)
+            print(f"Preset error: for some reason, preset {elem} is under 144 bytes long.")
+            sys.exit(1)
+        if (data_len - 143) % 48 != 0: # Samples used by the presets all are 48 bytes long, the first one ends 143 bytes in
+            print(f"Preset error: for some reason, preset {elem} does not hold a correct format:")
+            print("a sample declaration has a size different of 48 bytes.")
+            sys.exit(1)
+        for fetcher in range(fetcher,data_len - 29,48): # the ID of the next sample is 48 bytes afterwards
+            wavi_list[int.from_bytes(datas[fetcher:(fetcher+2)],'little')] = None # kept once, even if used many times
+
+    if len(prgi_list) != len(preset_names):
         print('One or multiple presets were not successfully read.')
-        print('Terminating.')
-        sys.exit(1)
+        return None,list(wavi_list)
+    return prgi_list,list(wavi_list)
 
+def make_keygroups():
+    """ Gives the keygroups declared in every SWD file.
+    Returns:
+        list: the keygroups
+    """
     # ugly static keygroups
     first_kgrp = KeygroupEntry()
     first_kgrp.add_general_infos(id=b'\x00\x00',poly=b'\xFF',priority=b'\x08',vclow=b'\x00',vchigh=b'\xFF',unk50=b'\x00',unk51=b'\x00')
@@ -354,40 +362,100 @@ def main():
     kgrp_list.append(fifth_kgrp)
     kgrp_list.append(sixth_kgrp)
     kgrp_list.append(seventh_kgrp)
+    return kgrp_list
 
+def build_swd(link_byte,prgi_list,wavi_list,store):
+    """ Generates an SWD file holding the presets given.
+    Arguments:
+        link_byte(bytes): the value of the link bytes
+        prgi_list(list): the presets to declare, in order of their ID
+        wavi_list(list): the ID's of the samples used by the presets
+        store(SoundStore): the store holding the samples
+
+    Returns:
+        bytes: the content of the SWD file (None if the presets use no sample, a song without presets for example)
+    """
+    if len(wavi_list) == 0:
+        print('The presets use no sample: no SWD file is generated.')
+        return None
+    kgrp_list = make_keygroups()
     max_wavi = max(wavi_list) # getting highest sample ID
     wavi_list = sorted(wavi_list) # the samples must be declared in ascending order
+    # the chunks are made first: the header holds the length of the file and of the wavi chunk
+    chunks = io.BytesIO()
+    with profiling.stage("samples",len(wavi_list)):
+        wavi_chunk_length = generate_wavi_chunk(chunks,wavi_list,max_wavi,store)
+    with profiling.stage("presets",len(prgi_list)):
+        generate_prgi_chunk(chunks,prgi_list)
+    with profiling.stage("keygroups",len(kgrp_list)):
+        generate_kgrp_chunk(chunks,kgrp_list)
+    generate_eod_chunk(chunks)
+    file = io.BytesIO()
+    with profiling.stage("header"):
+        header_chunk_length = 80
+        file_size = header_chunk_length + len(chunks.getbuffer())
+        generate_header_chunk(file,max_wavi,link_byte,file_size,wavi_chunk_length - 16)
+    file.write(chunks.getbuffer())
+    return file.getvalue()
+
+def check_config(configs):
+    """ Checks the SWD configuration made by MIDIconvert (preset_output.json)
+    The program stops if the link byte is not usable.
+    Arguments:
+        configs(dict): the configuration
+
+    Returns:
+        bytes: the value of the link bytes
+        list: the names of the presets, in order of their ID
+    """
+    link_byte = configs['link_byte']
+    if len(link_byte) != 4:
+        print("config error: link byte is not of length 4")
+        sys.exit(1)
+    try:
+        link_byte = str.encode(link_byte)
+    except Exception as e:
+        print("hex function failure")
+        print(e)
+        sys.exit(1)
+    preset_list = []
+    for preset in configs['presets']:
+        preset_name = preset['name']
+        preset_list.append(preset_name)
+    return link_byte,preset_list
+
+def main():
+    args = parse_args()
+    dir_path = f"SMDS/{args.SWD}"
+    json_path = dir_path + '/preset_output.json'
+    if not os.path.exists(json_path):
+        print(f"Configuration file {json_path} is not found")
+        sys.exit(1)
+
+    profiling.start(args)
+    with profiling.stage("json"):
+        with open(json_path,'r') as data:
+            configs = json.load(data)
+        link_byte,preset_list = check_config(configs)
+    print('Processing...')
+    with profiling.stage("preset loading",len(preset_list)):
+        store = get_store()
+        prgi_list,wavi_list = load_presets(preset_list,store)
+    if prgi_list is None:
+        print('Terminating.')
+        sys.exit(1)
+
     swd = dir_path + f'/{args.SWD}.swd'
-    with open(swd,"wb") as file:
-        header_chunk_length = generate_header_chunk(file,max_wavi,link_byte)
-        wavi_chunk_length = generate_wavi_chunk(file,wavi_list,max_wavi)
-        wavi_len_towrite = wavi_chunk_length - 16# The chunk length value to edit in the file
-        prgi_chunk_length = generate_prgi_chunk(file,prgi_list)
-        prgi_len_towrite = prgi_chunk_length - 16# The chunk length value to edit in the file
-        kgrp_chunk_length,padding = generate_kgrp_chunk(file,kgrp_list)
-        kgrp_len_towrite = kgrp_chunk_length -16 # The chunk length value to edit in the file
-        kgrp_chunk_length = kgrp_chunk_length + padding
-        eod_chunk_length = generate_eod_chunk(file)
-        file_size = ( header_chunk_length
-                        + wavi_chunk_length
-                        + prgi_chunk_length
-                        + kgrp_chunk_length
-                        + eod_chunk_length)
-    with open(swd,"rb+") as fix_length:
-        parse_bytes(fix_length,8)
-        fix_length.write(file_size.to_bytes(4,'little'))
-        parse_bytes(fix_length,64) #goto wavi chunklen (the first)
-        fix_length.write(wavi_len_towrite.to_bytes(4,'little'))
-        parse_bytes(fix_length,12) #goto wavi chunklen (the second)
-        fix_length.write(wavi_len_towrite.to_bytes(4,'little'))
-        parse_bytes(fix_length,wavi_len_towrite)# goto prgi chunk
-        parse_bytes(fix_length,12) #goto prgi chunklen
-        fix_length.write(prgi_len_towrite.to_bytes(4,'little'))
-        parse_bytes(fix_length,prgi_len_towrite)# goto prgi chunk
-        parse_bytes(fix_length,12) #goto kgrp chunklen
-        fix_length.write(kgrp_len_towrite.to_bytes(4,'little'))
+    swd_data = build_swd(link_byte,prgi_list,wavi_list,store)
+    if swd_data is None:
+        print('Terminating.')
+        sys.exit(1)
+    with profiling.stage("write"):
+        with open(swd,"wb") as file:
+            file.write(swd_data)
 
     print(f'file {swd} was generated successfully.')
+    profiling.report()
 
 if __name__ == "__main__":
     main()
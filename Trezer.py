@@ -0,0 +1,292 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import MIDIconvert
+import MIDIparse
+import SWDgen
+from cache import DEFAULT_SIZE,ConversionCache,store_signature
+from store import get_store,reopen_store
+
+def parse_args():
+    """ creates the parser of the command line
+
+    Returns:
+        Namespace: the values given as arguments in the CLI.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog = "Trezer",
+        description="Converts a MIDI file into an SMD and SWD file in the SMDS directory, in a single step."
+    )
+
+    parser.add_argument("midi",help="The path to the MIDI file to convert (or, with --watch, a directory of MIDI files)")
+    parser.add_argument("output",help="The name of the SMD and SWD files to write (with --watch on a directory, the files are named after the MIDI files)",nargs='?')
+    parser.add_argument("--loop",help="Makes the song loop at a specific time in ticks(?). Defaults to 0 if unspecified.",default=0,type= (int))
+    parser.add_argument("--linkbyte",help="value (in hex) of the 2 bytes that handles the SMD/SWD connection. Defaults to 0000 if unspecified",type=str, default= '0000')
+    parser.add_argument("--pmd-soundfont",help="Maps the preset used to the PMD soundfont. Maps to the GM soundfont otherwise.",action="store_true")
+    parser.add_argument("--presets",help="A preset_output.json file (edited from a previous conversion) giving the presets to put in the SWD.",type=str,default=None)
+    parser.add_argument("--jobs",help="The amount of processes converting the tracks at the same time. Defaults to 1.",type=int,default=1)
+    MIDIconvert.add_resample_arguments(parser)
+    add_cache_arguments(parser)
+    parser.add_argument("--watch",help="Converts again each time the MIDI file (or a MIDI file of the directory) changes, until interrupted (Ctrl+C).",action="store_true")
+    parser.add_argument("--interval",help="With --watch, the time in seconds between two checks for changes. Defaults to 1.",type=float,default=1.0)
+    return parser.parse_args()
+
+def add_cache_arguments(parser):
+    """ adds the options of the conversion cache to the parser of a command line tool
+    Arguments:
+        parser(ArgumentParser): the parser of the command line
+    """
+    parser.add_argument("--no-cache",help="Converts again even if the same file was converted before with the same options.",action="store_true")
+    parser.add_argument("--cache-size",help=f"The size limit (in MB) of the conversion cache, in SMDS/.cache. Defaults to {DEFAULT_SIZE}.",type=int,default=DEFAULT_SIZE)
+
+
+class Options:
+
+    def __init__(self,loop=0,link_byte='0000',pmd_soundfont=False,presets=None,jobs=1,tpqn=None,rounding='nearest'):
+        self.loop = loop
+        self.link_byte = link_byte
+        self.pmd_soundfont = pmd_soundfont
+        self.presets = presets # the names of the presets of the SWD, replacing the default ones
+        self.jobs = jobs # the amount of processes converting the tracks (the files are the same whatever the amount)
+        self.tpqn = tpqn # the ticks per quarter note the song is resampled to (None to keep the ones of the MIDI file)
+        self.rounding = rounding
+
+
+def convert(midi_bytes,options,cache=None):
+    """ Converts a MIDI file into an SMD and SWD file.
+    The steps of MIDIparse, MIDIconvert and SWDgen are chained in memory:
+    no instruction file nor configuration file is written.
+    A conversion kept in the cache is given back without converting again.
+    Arguments:
+        midi_bytes(bytes): the content of the MIDI file
+        options(Options): the conversion options
+        cache(ConversionCache): the conversions made before (None to always convert)
+
+    Returns:
+        bytes: the content of the SMD file
+        bytes: the content of the SWD file (None if a preset is unavailable, or if the song uses none)
+        dict: the SWD configuration (as written in preset_output.json)
+    """
+    if cache is not None:
+        key = cache.key(midi_bytes,options)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    smd,preset_config = convert_smd(midi_bytes,options)
+    swd = generate_swd(preset_config)
+    if cache is not None:
+        cache.put(key,smd,swd,preset_config)
+    return smd,swd,preset_config
+
+def convert_smd(midi_bytes,options,track_chunks=None):
+    """ Converts a MIDI file into an SMD file and its SWD configuration.
+    Arguments:
+        midi_bytes(bytes): the content of the MIDI file
+        options(Options): the conversion options
+        track_chunks(dict): the tracks converted for the previous version of the file (see MIDIconvert.convert_song)
+
+    Returns:
+        bytes: the content of the SMD file
+        dict: the SWD configuration (as written in preset_output.json)
+    """
+    song = MIDIparse.parse_song(midi_bytes,options.loop)
+    if options.tpqn is not None:
+        song = MIDIconvert.resample_song(song,options.tpqn,options.rounding)
+    smd,programs_list = MIDIconvert.convert_song(song,options.link_byte,options.pmd_soundfont,track_chunks,options.jobs)
+    preset_config = MIDIconvert.make_preset_config(options.link_byte,programs_list)
+    if options.presets is not None:
+        preset_config["presets"] = [{"name": name} for name in options.presets]
+    return smd,preset_config
+
+def generate_swd(preset_config):
+    """ Generates the SWD file of a configuration.
+    Arguments:
+        preset_config(dict): the SWD configuration
+
+    Returns:
+        bytes: the content of the SWD file (None if a preset is unavailable, or if the song uses none)
+    """
+    link_byte,preset_names = SWDgen.check_config(preset_config)
+    store = get_store()
+    prgi_list,wavi_list = SWDgen.load_presets(preset_names,store)
+    if prgi_list is None:
+        return None
+    return SWDgen.build_swd(link_byte,prgi_list,wavi_list,store)
+
+
+def write_outputs(output,smd,swd,preset_config):
+    """ Writes the converted files in the SMDS/<output> directory.
+    Arguments:
+        output(str): the name of the SMD and SWD files
+        smd(bytes): the content of the SMD file
+        swd(bytes): the content of the SWD file (not written if None)
+        preset_config(dict): the SWD configuration
+
+    Returns:
+        str: the directory the files were written in
+    """
+    dir_path = f'SMDS/{output}'
+    os.makedirs(dir_path,exist_ok=True)
+    with open(f'{dir_path}/{output}.smd',"wb") as file:
+        file.write(smd)
+    with open(f'{dir_path}/preset_output.json',"w") as json_file:
+        json.dump(preset_config, json_file, indent=4)
+    if swd is not None:
+        with open(f'{dir_path}/{output}.swd',"wb") as file:
+            file.write(swd)
+    return dir_path
+
+
+class WatchedFile:
+
+    def __init__(self,path,output):
+        self.path = path
+        self.output = output # the name of the SMD and SWD files
+        self.signature = None # the size and modification time of the file when last converted
+        self.track_chunks = {} # the tracks converted for the last version of the file
+        self.preset_config = None # the SWD configuration of the last version
+        self.swd = None
+        self.store_signature = None # the presets available when the SWD was generated
+
+    def changed(self):
+        """ tells if the file changed since it was last converted
+        Returns:
+            bool: True if the file changed
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError: # being saved
+            return False
+        signature = (stat.st_size,stat.st_mtime_ns)
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+    def convert(self,options):
+        """ Converts the file again: only the tracks that changed are converted,
+        and the SWD is only generated again if the presets used or available changed
+        (or if it could not be generated, e.g. until the missing presets are fetched).
+        A failure is printed and the previous files are kept.
+        Arguments:
+            options(Options): the conversion options
+        """
+        print(f"\n{self.path} changed, converting...")
+        try:
+            # the file is read, not mapped: a mapped file could not be saved again on Windows
+            with open(self.path,'rb') as midi:
+                midi_bytes = midi.read()
+            smd,preset_config = convert_smd(midi_bytes,options,self.track_chunks)
+            signature = store_signature()
+            if signature != self.store_signature: # fetched again since: the store may have been replaced
+                reopen_store()
+            if preset_config != self.preset_config or self.swd is None or signature != self.store_signature:
+                self.swd = generate_swd(preset_config)
+                self.preset_config = preset_config
+                self.store_signature = signature
+            else:
+                print("The presets did not change: the SWD file is kept.")
+        except SystemExit: # the messages explaining the failure were printed
+            print(f"{self.path} could not be converted, waiting for the next change.")
+            return
+        except Exception as e:
+            print(f"an exception has occured: {e!r}")
+            print(f"{self.path} could not be converted, waiting for the next change.")
+            return
+        dir_path = write_outputs(self.output,smd,self.swd,preset_config)
+        swd_state = "" if self.swd is not None else " (without SWD)"
+        print(f"{self.output}.smd was generated in {dir_path}{swd_state}.")
+
+
+def watched_files(path,output,files):
+    """ Lists the MIDI files to watch: the file given, or the MIDI files of the directory.
+    Arguments:
+        path(str): the path of the MIDI file or of the directory
+        output(str): the name of the SMD and SWD files (for a single file)
+        files(dict): the files watched so far, by path. Files added to the directory are added.
+
+    Returns:
+        dict: the files to watch, by path
+    """
+    if not os.path.isdir(path):
+        if path not in files:
+            files[path] = WatchedFile(path,output)
+        return files
+    for name in sorted(os.listdir(path)):
+        stem,extension = os.path.splitext(name)
+        file_path = os.path.join(path,name)
+        if extension.lower() in ('.mid','.midi') and file_path not in files:
+            files[file_path] = WatchedFile(file_path,stem)
+    return files
+
+def watch(path,output,options,interval):
+    """ Converts the MIDI files each time they change, until interrupted.
+    Arguments:
+        path(str): the path of the MIDI file or of the directory
+        output(str): the name of the SMD and SWD files (for a single file)
+        options(Options): the conversion options
+        interval(float): the time in seconds between two checks
+    """
+    print(f"Watching {path} (Ctrl+C to stop)...")
+    files = {}
+    try:
+        while True:
+            for watched in watched_files(path,output,files).values():
+                if watched.changed():
+                    watched.convert(options)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+
+
+def main():
+    args = parse_args()
+    if args.output is None and not (args.watch and os.path.isdir(args.midi)):
+        print("argument error: the name of the files to write is missing.")
+        sys.exit(1)
+    if args.jobs < 1:
+        print("option error: at least one job is needed.")
+        sys.exit(1)
+    if args.interval <= 0:
+        print("option error: the watch interval must be positive.")
+        sys.exit(1)
+    if not os.path.exists(args.midi):
+        print(f"File {args.midi} is not found")
+        sys.exit(1)
+    if args.loop < 0:
+        print("option error: loop value is negative.")
+        sys.exit(1)
+    if args.cache_size < 0:
+        print("option error: cache size is negative.")
+        sys.exit(1)
+    MIDIconvert.check_link_byte(args.linkbyte)
+    MIDIconvert.check_tpqn(args.tpqn)
+    presets = None
+    if args.presets is not None:
+        with open(args.presets,'r') as data:
+            presets = [preset['name'] for preset in json.load(data)['presets']]
+    options = Options(args.loop,args.linkbyte,args.pmd_soundfont,presets,args.jobs,args.tpqn,args.rounding)
+    if args.watch:
+        watch(args.midi,args.output,options,args.interval)
+        return
+    cache = None if args.no_cache else ConversionCache(max_size=args.cache_size * 1024 * 1024)
+    with MIDIparse.read_midi(args.midi) as midi_bytes:
+        smd,swd,preset_config = convert(midi_bytes,options,cache)
+    dir_path = write_outputs(args.output,smd,swd,preset_config)
+    print(f"\nThe SMD file {args.output}.smd was generated in {dir_path}.")
+    if swd is None and len(preset_config["presets"]) == 0:
+        print('The song uses no preset: no SWD file was generated.')
+    elif swd is None:
+        print('The SWD file could not be generated: edit preset_output.json, then execute SWDgen')
+        print(f'or convert again with --presets {dir_path}/preset_output.json')
+    else:
+        print(f"The SWD file {args.output}.swd was generated in {dir_path}.")
+    if cache is not None:
+        print(cache.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import MIDIconvert
+import MIDIparse
+import Trezer
+from cache import ConversionCache
+from store import prefetch_store
+
+def parse_args():
+    """ creates the parser of the command line
+
+    Returns:
+        Namespace: the values given as arguments in the CLI.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog = "TrezerBatch",
+        description="Converts many MIDI files at once into SMD and SWD files in the SMDS directory."
+    )
+
+    parser.add_argument("input",help="A directory holding the MIDI files to convert, or a manifest file listing them (one path per line, optionally followed by a tab and the output name)")
+    parser.add_argument("--workers",help="The amount of files converted at the same time. Defaults to the amount of CPUs.",default=os.cpu_count(),type=int)
+    parser.add_argument("--report",help="The path of the JSON report to write. Defaults to SMDS/batch_report.json",type=str,default="SMDS/batch_report.json")
+    parser.add_argument("--loop",help="Makes the songs loop at a specific time in ticks(?). Defaults to 0 if unspecified.",default=0,type= (int))
+    parser.add_argument("--linkbyte",help="value (in hex) of the 2 bytes that handles the SMD/SWD connection. Defaults to 0000 if unspecified",type=str, default= '0000')
+    parser.add_argument("--pmd-soundfont",help="Maps the preset used to the PMD soundfont. Maps to the GM soundfont otherwise.",action="store_true")
+    MIDIconvert.add_resample_arguments(parser)
+    Trezer.add_cache_arguments(parser)
+    parser.add_argument("--pipeline",help="Reads the next MIDI files and writes the converted ones while the others are converted (useful when the files are on a slow or network drive).",action="store_true")
+    parser.add_argument("--queue-depth",help="With --pipeline, the amount of MIDI files read ahead. Defaults to 4.",default=4,type=int)
+    return parser.parse_args()
+
+
+def list_jobs(input):
+    """ Lists the MIDI files to convert, and the name of their output.
+    A directory gives all its .mid/.midi files, named after the MIDI file.
+    A manifest gives one MIDI path per line, optionally followed by a tab
+    and the output name. Empty lines and lines starting with # are skipped.
+    Arguments:
+        input(str): the path of the directory or of the manifest
+
+    Returns:
+        list: the (MIDI path, output name) to convert
+    """
+    jobs = []
+    if os.path.isdir(input):
+        for name in sorted(os.listdir(input)):
+            stem,extension = os.path.splitext(name)
+            if extension.lower() in ('.mid','.midi'):
+                jobs.append((os.path.join(input,name),stem))
+        return jobs
+    base = os.path.dirname(input)
+    with open(input,'r') as manifest:
+        for line in manifest:
+            line = line.rstrip('\n')
+            if len(line.strip()) == 0 or line.startswith('#'):
+                continue
+            path,_,output = line.partition('\t')
+            path = os.path.join(base,path.strip())
+            output = output.strip() or os.path.splitext(os.path.basename(path))[0]
+            jobs.append((path,output))
+    return jobs
+
+
+def read_file(path):
+    """ Reads a MIDI file in one go
+    Arguments:
+        path(str): the path of the MIDI file
+
+    Returns:
+        bytes: the content of the file
+    """
+    with open(path,'rb') as midi:
+        return midi.read()
+
+def convert_job(midi_path,output,options,cache_size=None,midi_bytes=None):
+    """ Converts one MIDI file, in memory.
+    Any failure is reported instead of stopping the batch: the messages
+    printed by the conversion steps are kept in the result.
+    Arguments:
+        midi_path(str): the path of the MIDI file
+        output(str): the name of the SMD and SWD files to write
+        options(Options): the conversion options
+        cache_size(int): the size limit of the conversion cache in bytes (None to always convert)
+        midi_bytes(bytes): the content of the MIDI file (None to read it)
+
+    Returns:
+        dict: the result of the conversion (status, time spent, messages)
+        tuple: the SMD, SWD and configuration made (None if the conversion failed)
+    """
+    start = time.perf_counter()
+    messages = io.StringIO()
+    result = {"midi": midi_path,"output": output}
+    cache = None if cache_size is None else ConversionCache(max_size=cache_size)
+    files = None
+    try:
+        with contextlib.redirect_stdout(messages):
+            if midi_bytes is None:
+                with MIDIparse.read_midi(midi_path) as data:
+                    files = Trezer.convert(data,options,cache)
+            else:
+                files = Trezer.convert(midi_bytes,options,cache)
+        result["status"] = "ok" if files[1] is not None else "no swd"
+    except SystemExit:
+        result["status"] = "failed"
+    except Exception as e:
+        result["status"] = "failed"
+        messages.write(f"an exception has occured: {e!r}\n")
+    result["seconds"] = round(time.perf_counter() - start,4)
+    if cache is not None:
+        result["cached"] = cache.hits > 0
+        result["evictions"] = cache.evictions
+    if result["status"] != "ok":
+        # keeping only the lines explaining the failure
+        result["messages"] = [line for line in messages.getvalue().splitlines() if not line.startswith(("writing track","done."))]
+    return result,files
+
+def write_result(result,files):
+    """ Writes the files of a conversion. A failure is kept in the result.
+    Arguments:
+        result(dict): the result of the conversion
+        files(tuple): the SMD, SWD and configuration made (None if the conversion failed)
+
+    Returns:
+        dict: the result
+    """
+    if files is None:
+        return result
+    try:
+        Trezer.write_outputs(result["output"],*files)
+    except OSError as e:
+        result["status"] = "failed"
+        result["messages"] = [f"the files could not be written: {e!r}"]
+    return result
+
+def convert_file(midi_path,output,options,cache_size=None):
+    """ Converts one MIDI file and writes its SMD, SWD and configuration.
+    Arguments:
+        midi_path(str): the path of the MIDI file
+        output(str): the name of the SMD and SWD files to write
+        options(Options): the conversion options
+        cache_size(int): the size limit of the conversion cache in bytes (None to always convert)
+
+    Returns:
+        dict: the result of the conversion (status, time spent, messages)
+    """
+    start = time.perf_counter()
+    result = write_result(*convert_job(midi_path,output,options,cache_size))
+    result["seconds"] = round(time.perf_counter() - start,4)
+    return result
+
+def failed_result(midi_path,output,message):
+    """ Gives the result of a file that could not be converted.
+    Arguments:
+        midi_path(str): the path of the MIDI file
+        output(str): the name of the SMD and SWD files to write
+        message(str): what made the conversion fail
+
+    Returns:
+        dict: the result of the conversion
+    """
+    return {"midi": midi_path,"output": output,"status": "failed","seconds": 0,"messages": [message]}
+
+def print_result(result):
+    """ prints the status of a file once it is converted
+    Arguments:
+        result(dict): the result of the conversion
+    """
+    cached = " cached" if result.get("cached") else ""
+    print(f"[{result['status']:>7}] {result['midi']} ({result['seconds']}s{cached})")
+
+
+def run_batch(jobs,options,workers,cache_size=None):
+    """ Converts every MIDI file, using a pool of processes.
+    Arguments:
+        jobs(list): the (MIDI path, output name) to convert
+        options(Options): the conversion options
+        workers(int): the amount of processes
+        cache_size(int): the size limit of the conversion cache in bytes (None to always convert)
+
+    Returns:
+        list: the results of the conversions, in the order of the jobs
+    """
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_file,path,output,options,cache_size): i for i,(path,output) in enumerate(jobs)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool: # a process was killed (out of memory, crash...): the pool stops
+                result = failed_result(*jobs[i],"the process converting the file stopped abruptly")
+            results[i] = result
+            print_result(result)
+    return results
+
+async def run_pipeline(jobs,options,workers,queue_depth,cache_size=None,read=read_file):
+    """ Converts every MIDI file, overlapping the reads and writes with the conversions:
+    the next MIDI files are read by threads while the ones read are converted
+    by a pool of processes (each reading the preset store ahead once started),
+    and the files converted are written while the next ones are converted.
+    Arguments:
+        jobs(list): the (MIDI path, output name) to convert
+        options(Options): the conversion options
+        workers(int): the amount of files converted at the same time
+        queue_depth(int): the amount of MIDI files read ahead
+        cache_size(int): the size limit of the conversion cache in bytes (None to always convert)
+        read(function): reads a MIDI file, given its path
+
+    Returns:
+        list: the results of the conversions, in the order of the jobs
+    """
+    loop = asyncio.get_running_loop()
+    results = [None] * len(jobs)
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(queue_depth) # the files read ahead, until a converter takes them
+    writes = []
+
+    async def prefetch():
+        for i,(path,output) in enumerate(jobs):
+            # waits once queue_depth files are read ahead, before starting the next read
+            await slots.acquire()
+            queue.put_nowait((i,path,output,loop.run_in_executor(io_executor,read,path)))
+        for _ in range(workers):
+            queue.put_nowait(None)
+
+    async def write(i,result,files):
+        results[i] = await loop.run_in_executor(io_executor,write_result,result,files)
+        print_result(results[i])
+
+    async def convert():
+        while (job := await queue.get()) is not None:
+            slots.release()
+            i,path,output,reading = job
+            try:
+                midi_bytes = await reading
+            except OSError as e:
+                results[i] = failed_result(path,output,f"the file could not be read: {e!r}")
+                print_result(results[i])
+                continue
+            try:
+                result,files = await loop.run_in_executor(executor,convert_job,path,output,options,cache_size,midi_bytes)
+            except BrokenProcessPool: # a process was killed (out of memory, crash...): the pool stops
+                results[i] = failed_result(path,output,"the process converting the file stopped abruptly")
+                print_result(results[i])
+                continue
+            writes.append(asyncio.create_task(write(i,result,files)))
+
+    with ThreadPoolExecutor(max_workers=queue_depth + workers) as io_executor, \
+        ProcessPoolExecutor(max_workers=workers,initializer=prefetch_store) as executor:
+        await asyncio.gather(prefetch(),*(convert() for _ in range(workers)))
+        await asyncio.gather(*writes)
+    return results
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.input):
+        print(f"{args.input} is not found")
+        sys.exit(1)
+    if args.loop < 0:
+        print("option error: loop value is negative.")
+        sys.exit(1)
+    if args.workers < 1:
+        print("option error: at least one worker is needed.")
+        sys.exit(1)
+    if args.cache_size < 0:
+        print("option error: cache size is negative.")
+        sys.exit(1)
+    if args.queue_depth < 1:
+        print("option error: the queue depth must be at least 1.")
+        sys.exit(1)
+    MIDIconvert.check_link_byte(args.linkbyte)
+    MIDIconvert.check_tpqn(args.tpqn)
+    jobs = list_jobs(args.input)
+    if len(jobs) == 0:
+        print(f"No MIDI file found in {args.input}")
+        sys.exit(1)
+    options = Trezer.Options(args.loop,args.linkbyte,args.pmd_soundfont,tpqn=args.tpqn,rounding=args.rounding)
+    print(f"Converting {len(jobs)} files with {args.workers} workers...")
+    start = time.perf_counter()
+    cache_size = None if args.no_cache else args.cache_size * 1024 * 1024
+    if args.pipeline:
+        results = asyncio.run(run_pipeline(jobs,options,args.workers,args.queue_depth,cache_size))
+    else:
+        results = run_batch(jobs,options,args.workers,cache_size)
+    elapsed = time.perf_counter() - start
+
+    failures = [result for result in results if result["status"] == "failed"]
+    missing_swd = [result for result in results if result["status"] == "no swd"]
+    report = {"files": len(results),
+        "converted": len(results) - len(failures),
+        "failed": len(failures),
+        "without_swd": len(missing_swd),
+        "seconds": round(elapsed,4),
+        "results": results}
+    if cache_size is not None:
+        hits = sum(1 for result in results if result.get("cached"))
+        report["cache"] = {"hits": hits,
+            "misses": len(results) - hits,
+            "evictions": sum(result.get("evictions",0) for result in results)}
+    report_dir = os.path.dirname(args.report)
+    if report_dir:
+        os.makedirs(report_dir,exist_ok=True)
+    with open(args.report,"w") as json_file:
+        json.dump(report, json_file, indent=4)
+
+    print(f"\n{report['converted']}/{len(results)} files converted in {elapsed:.2f}s ({len(missing_swd)} without SWD).")
+    if cache_size is not None:
+        cache = report["cache"]
+        print(f"cache: {cache['hits']} hit(s), {cache['misses']} miss(es), {cache['evictions']} eviction(s)")
+    for result in failures:
+        print(f"failed: {result['midi']}")
+        for line in result["messages"]:
+            print(f"    {line}")
+    print(f"The report was written in {args.report}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import struct
+
+from store import STORE_PATH
+
+# The conversions made by Trezer, kept on disk to be given back without converting again.
+# An entry is named after the SHA-256 of everything the conversion depends on:
+# the MIDI file, the options, the source of the converter and the presets available.
+# Layout of an entry (little endian):
+# - header: magic, length of the SMD, length of the SWD (NO_SWD if there is none), length of the configuration
+# - the SMD, the SWD and the configuration (JSON, utf-8), one after the other
+# The least recently used entries are removed once the cache is larger than its size limit.
+CACHE_PATH = 'SMDS/.cache'
+MAGIC = b'TRZK'
+HEADER = struct.Struct('<4sIII')
+NO_SWD = 0xFFFFFFFF
+DEFAULT_SIZE = 256 # in MB
+
+# the modules whose source makes the output of a conversion
+# (store.py reads the presets and samples put in the SWD: the content of the store is covered by store_signature)
+CONVERTER_MODULES = ('MIDIparse.py','MIDIconvert.py','SWDgen.py','Trezer.py','events.py','smd.py','soundfont.py','store.py','utils.py')
+
+_converter_version = None
+
+def converter_version():
+    """ Gives the version of the converter: the SHA-256 of the source of its modules.
+    Any change to the converter makes the previous entries unused.
+    Returns:
+        str: the version (hexadecimal)
+    """
+    global _converter_version
+    if _converter_version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in CONVERTER_MODULES:
+            with open(os.path.join(directory,name),'rb') as source:
+                digest.update(source.read())
+        _converter_version = digest.hexdigest()
+    return _converter_version
+
+def store_signature():
+    """ Gives what tells the presets available apart: the size and modification time
+    of the store, and the modification time of the PRESETS and SAMPLES directories.
+    Returns:
+        list: the signature
+    """
+    signature = []
+    for path in (STORE_PATH,'PRESETS','SAMPLES'):
+        try:
+            stat = os.stat(path)
+            signature.append([stat.st_size if path == STORE_PATH else 0,stat.st_mtime_ns])
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+def decode_entry(data):
+    """ Reads the conversion kept in an entry.
+    Arguments:
+        data(bytes): the content of the entry
+
+    Returns:
+        tuple: the SMD, SWD (None if there is none) and configuration (None if the entry is truncated or corrupt)
+    """
+    if len(data) < HEADER.size:
+        return None
+    magic,smd_length,swd_length,config_length = HEADER.unpack_from(data,0)
+    if magic != MAGIC:
+        return None
+    offset = HEADER.size
+    swd_size = 0 if swd_length == NO_SWD else swd_length
+    if offset + smd_length + swd_size + config_length != len(data):
+        return None
+    smd = data[offset:offset + smd_length]
+    offset += smd_length
+    swd = None
+    if swd_length != NO_SWD:
+        swd = data[offset:offset + swd_length]
+        offset += swd_length
+    try:
+        preset_config = json.loads(data[offset:offset + config_length].decode())
+    except ValueError: # JSONDecodeError and UnicodeDecodeError
+        return None
+    return smd,swd,preset_config
+
+
+class ConversionCache:
+
+    def __init__(self,path=CACHE_PATH,max_size=DEFAULT_SIZE * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size # in bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self,midi_bytes,options):
+        """ Gives the name of the entry of a conversion
+        Arguments:
+            midi_bytes(bytes): the content of the MIDI file
+            options(Options): the conversion options
+
+        Returns:
+            str: the key of the entry (hexadecimal)
+        """
+        digest = hashlib.sha256(midi_bytes)
+        parameters = {"loop": options.loop,"link_byte": options.link_byte,"pmd_soundfont": options.pmd_soundfont,
+            "presets": options.presets,"tpqn": options.tpqn,"rounding": options.rounding,"version": converter_version(),"store": store_signature()}
+        digest.update(json.dumps(parameters,sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self,key):
+        """ Gives back a conversion made before.
+        Arguments:
+            key(str): the key of the entry
+
+        Returns:
+            tuple: the SMD, SWD (None if there is none) and configuration (None if the entry is missing)
+        """
+        entry_path = os.path.join(self.path,key)
+        try:
+            with open(entry_path,'rb') as entry:
+                data = entry.read()
+            os.utime(entry_path) # most recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        entry = decode_entry(data)
+        if entry is None: # truncated or corrupt (an interrupted copy, a full disk...): converted again
+            self.misses += 1
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError: # removed by another process
+                pass
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self,key,smd,swd,preset_config):
+        """ Keeps a conversion, then removes the least recently used entries
+        if the cache is above its size limit.
+        Arguments:
+            key(str): the key of the entry
+            smd(bytes): the content of the SMD file
+            swd(bytes): the content of the SWD file (None if there is none)
+            preset_config(dict): the SWD configuration
+        """
+        os.makedirs(self.path,exist_ok=True)
+        config = json.dumps(preset_config).encode()
+        entry_path = os.path.join(self.path,key)
+        temporary_path = f'{entry_path}.{os.getpid()}.tmp'
+        # written aside then renamed: another process may be reading (or writing) the entry
+        with open(temporary_path,'wb') as entry:
+            entry.write(HEADER.pack(MAGIC,len(smd),NO_SWD if swd is None else len(swd),len(config)))
+            entry.write(smd)
+            if swd is not None:
+                entry.write(swd)
+            entry.write(config)
+        os.replace(temporary_path,entry_path)
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in its size limit """
+        entries = []
+        total = 0
+        with os.scandir(self.path) as directory:
+            for entry in directory:
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by another process
+                    continue
+                entries.append((stat.st_mtime_ns,stat.st_size,entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _,size,entry_path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def report(self):
+        """ Gives the statistics of the cache
+        Returns:
+            str: the amount of hits, misses and evictions
+        """
+        return f"cache: {self.hits} hit(s), {self.misses} miss(es), {self.evictions} eviction(s)"
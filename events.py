@@ -0,0 +1,419 @@
+import bisect
+import hashlib
+import itertools
+import operator
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError: # NumPy is optional: the columns are scanned with the standard library without it
+    numpy = None
+
+# The instructions handed from MIDIparse to MIDIconvert.
+# Each instruction is a tuple (starttime, kind, a, b, value):
+# - PlayNote: a = key note, b = velocity, value = duration
+# - Aftertouch: a = key note, b = velocity
+# - ControlChange: a = controller number, b = value
+# - BankSelect: value = bank
+# - InstrChange: a = program
+# - Channel Aftertouch: a = pressure value
+# - PitchBend: a = least bytes, b = most bytes
+# - MetaMessage: a = meta type, value = data (0 if the data holds more than 4 bytes)
+# - Sysex event: value = length of the data
+# - LoopPoint: no parameters
+# The kinds are numbered in alphabetical order of their names:
+# instructions of a track are sorted by starttime then kind, as the text format did.
+AFTERTOUCH = 0
+BANK_SELECT = 1
+CHANNEL_AFTERTOUCH = 2
+CONTROL_CHANGE = 3
+INSTR_CHANGE = 4
+LOOP_POINT = 5
+META_MESSAGE = 6
+PITCH_BEND = 7
+PLAY_NOTE = 8
+SYSEX = 9
+
+# names of the meta-events, the ones holding text have their data written as hex.
+META_EVENTS = {
+    0x00: "Sequence Number", 0x01: "Text Event", 0x02: "Copyright Notice", 0x03: "Track Name",
+    0x04: "Instrument Name", 0x05: "Lyric", 0x06: "Marker", 0x07: "Cue Point",
+    0x20: "MIDI Channel Prefix", 0x51: "Set Tempo", 0x54: "SMPTE Offset", 0x58: "Time Signature",
+    0x59: "Key Signature", 0x7F: "Sequencer Specific Meta-Event"
+}
+META_TYPES = {name: meta_type for meta_type,name in META_EVENTS.items()}
+
+# the columns of a track, in the order of the instruction tuple
+COLUMNS = ('starttimes','kinds','a','b','values')
+
+MAGIC = b'TRZC'
+# magic, ntrks, tpqn, song duration
+HEADER = struct.Struct('<4sHHI')
+# channel (16 for the tempo channel), amount of instructions
+TRACK = struct.Struct('<BI')
+
+
+class Track:
+
+    def __init__(self,channel):
+        self.channel = channel # the MIDI channel of the track (16 for the tempo channel)
+        # the instructions of the track, stored by columns
+        self.starttimes = array('I')
+        self.kinds = array('B')
+        self.a = array('B')
+        self.b = array('B')
+        self.values = array('I')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return zip(self.starttimes,self.kinds,self.a,self.b,self.values)
+
+    def append(self,instruction):
+        """ adds an instruction at the end of the track
+        Arguments:
+            instruction(tuple): the instruction
+        """
+        starttime,kind,a,b,value = instruction
+        self.starttimes.append(starttime)
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.values.append(value)
+
+    def extend(self,starttimes,kinds,a,b,values):
+        """ adds instructions at the end of the track, column by column
+        Arguments:
+            starttimes(iterable): the starttime of each instruction
+            kinds(iterable): the kind of each instruction
+            a(iterable): the first parameter of each instruction
+            b(iterable): the second parameter of each instruction
+            values(iterable): the value of each instruction
+        """
+        self.starttimes.extend(starttimes)
+        self.kinds.extend(kinds)
+        self.a.extend(a)
+        self.b.extend(b)
+        self.values.extend(values)
+
+    def digest(self):
+        """ gives the SHA-256 of the instructions of the track
+        Returns:
+            bytes: the digest
+        """
+        digest = hashlib.sha256()
+        for name in COLUMNS:
+            digest.update(getattr(self,name))
+        return digest.digest()
+
+    def end_time(self):
+        """ Finds the time in ticks at which every instruction of the track is finished.
+        PlayNote instructions hold a note for their duration,
+        any other instruction is "instantaneous".
+        Returns:
+            int: the time at which the last instruction is finished (0 for an empty track)
+        """
+        if len(self) == 0:
+            return 0
+        if numpy is not None:
+            starttimes = numpy.frombuffer(self.starttimes,dtype=self.starttimes.typecode).astype(numpy.int64)
+            kinds = numpy.frombuffer(self.kinds,dtype=self.kinds.typecode)
+            values = numpy.frombuffer(self.values,dtype=self.values.typecode)
+            return int((starttimes + numpy.where(kinds == PLAY_NOTE,values,0)).max())
+        notes = map(PLAY_NOTE.__eq__,self.kinds)
+        note_ends = itertools.compress(map(operator.add,self.starttimes,self.values),notes)
+        return max(max(self.starttimes),max(note_ends,default=0))
+
+
+def split_channels(track,channels,tracks):
+    """ Adds instructions of many channels at the end of the track of their channel.
+    The instructions are ordered by channel with a stable sort,
+    so each channel keeps the order of the instructions given.
+    Needs NumPy: without it, split_batch is faster.
+    Arguments:
+        track(Track): the instructions to add
+        channels(array): the channel of each instruction
+        tracks(list): the track of each channel, indexed by channel
+    """
+    keys = numpy.frombuffer(channels,dtype=channels.typecode)
+    order = numpy.argsort(keys,kind='stable')
+    counts = numpy.bincount(keys,minlength=len(tracks)).tolist()
+    columns = [array(column.typecode,numpy.frombuffer(column,dtype=column.typecode).take(order).tobytes())
+               for column in map(track.__getattribute__,COLUMNS)]
+    start = 0
+    for channel_track,count in zip(tracks,counts):
+        if count > 0:
+            channel_track.extend(*(column[start:start + count] for column in columns))
+            start += count
+
+def split_batch(batch,tracks):
+    """ Adds a batch of instructions of many channels at the end of the track of their channel.
+    The batch is sorted by channel with a stable sort,
+    so each channel keeps the order of the instructions given.
+    Arguments:
+        batch(list): the instructions to add, as (starttime, kind, a, b, value, channel)
+        tracks(list): the track of each channel, indexed by channel
+    """
+    batch.sort(key=operator.itemgetter(5))
+    starttimes,kinds,a,b,values,channels = zip(*batch)
+    start = 0
+    while start < len(channels):
+        channel = channels[start]
+        end = bisect.bisect_right(channels,channel,start)
+        tracks[channel].extend(starttimes[start:end],kinds[start:end],a[start:end],b[start:end],values[start:end])
+        start = end
+
+
+class Song:
+
+    def __init__(self,tpqn,song_duration,tracks):
+        self.tpqn = tpqn
+        self.song_duration = song_duration
+        self.tracks = tracks # the tracks of the song, the tempo channel first
+
+
+# how a time falling between two ticks of the new tick rate is rounded (see resample)
+ROUNDINGS = ('nearest','down','up')
+
+def resample_track(track,tpqn,new_tpqn,offset):
+    """ counts the times of a track at another tick rate.
+    The start of each instruction and the end of each note are rounded,
+    a note lasting at least a tick if it did before.
+    Arguments:
+        track(Track): the track to resample
+        tpqn(int): the tick rate of the track (ticks per quarter note)
+        new_tpqn(int): the tick rate to count the times at
+        offset(int): added to a time (times new_tpqn) before dividing it by tpqn, which rounds it
+
+    Returns:
+        Track: the track resampled
+        int: the largest timing error, in ticks of the track times new_tpqn
+    """
+    resampled = Track(track.channel)
+    if len(track) == 0:
+        return resampled,0
+    if numpy is not None:
+        starttimes = numpy.frombuffer(track.starttimes,dtype=track.starttimes.typecode).astype(numpy.int64)
+        notes = numpy.frombuffer(track.kinds,dtype=track.kinds.typecode) == PLAY_NOTE
+        values = numpy.frombuffer(track.values,dtype=track.values.typecode).astype(numpy.int64)
+        new_starttimes = (starttimes * new_tpqn + offset) // tpqn
+        ends = ((starttimes + values) * new_tpqn + offset) // tpqn
+        durations = numpy.maximum(ends - new_starttimes,values > 0)
+        error = int(numpy.abs(new_starttimes * tpqn - starttimes * new_tpqn).max())
+        end_errors = numpy.abs((new_starttimes + durations) * tpqn - (starttimes + values) * new_tpqn)
+        error = max(error,int(end_errors.max(initial=0,where=notes)))
+        new_values = numpy.where(notes,durations,values)
+        resampled.extend(array('I',new_starttimes.astype(numpy.uint32).tobytes()),track.kinds,track.a,track.b,
+                         array('I',new_values.astype(numpy.uint32).tobytes()))
+        return resampled,error
+    starttimes = array('I')
+    values = array('I')
+    error = 0
+    for starttime,kind,value in zip(track.starttimes,track.kinds,track.values):
+        new_starttime = (starttime * new_tpqn + offset) // tpqn
+        error = max(error,abs(new_starttime * tpqn - starttime * new_tpqn))
+        if kind == PLAY_NOTE:
+            end = ((starttime + value) * new_tpqn + offset) // tpqn
+            duration = max(end - new_starttime,1 if value > 0 else 0)
+            error = max(error,abs((new_starttime + duration) * tpqn - (starttime + value) * new_tpqn))
+            value = duration
+        starttimes.append(new_starttime)
+        values.append(value)
+    resampled.extend(starttimes,track.kinds,track.a,track.b,values)
+    return resampled,error
+
+def resample(song,new_tpqn,rounding='nearest'):
+    """ counts the times of a song at another tick rate.
+    SMD files of the game use 48 ticks per quarter note: a MIDI file of 480 or 960
+    gives longer waits, which need more bytes to be written.
+    Arguments:
+        song(Song): the song to resample
+        new_tpqn(int): the tick rate to count the times at (ticks per quarter note)
+        rounding(str): how a time falling between two ticks is rounded: to the nearest, previous or next tick
+
+    Returns:
+        Song: the song resampled
+        float: the largest timing error, in ticks of the song given
+    """
+    tpqn = song.tpqn
+    offset = {'nearest': tpqn // 2,'down': 0,'up': tpqn - 1}[rounding]
+    tracks = []
+    error = 0
+    for track in song.tracks:
+        resampled,track_error = resample_track(track,tpqn,new_tpqn,offset)
+        tracks.append(resampled)
+        error = max(error,track_error)
+    # the notes lengthened to a tick may end after the song
+    song_duration = (song.song_duration * new_tpqn + offset) // tpqn
+    song_duration = max(song_duration,max((track.end_time() for track in tracks),default=0))
+    return Song(new_tpqn,song_duration,tracks),error / new_tpqn
+
+
+def column_bytes(column):
+    """ gives the content of a column, in little endian
+    Arguments:
+        column(array): the column
+
+    Returns:
+        bytes: the content of the column
+    """
+    if sys.byteorder == 'big':
+        column = array(column.typecode,column)
+        column.byteswap()
+    return column.tobytes()
+
+def write_song(fd,song):
+    """ writes a song in the binary instruction format:
+    a header, then for each track a small header followed by
+    its columns, one after the other.
+    Arguments:
+        fd(BufferedWriter): the file descriptor
+        song(Song): the song to write
+    """
+    fd.write(HEADER.pack(MAGIC,len(song.tracks),song.tpqn,song.song_duration))
+    for track in song.tracks:
+        fd.write(TRACK.pack(track.channel,len(track)))
+        for name in COLUMNS:
+            fd.write(column_bytes(getattr(track,name)))
+
+def read_song(fd):
+    """ reads a song written by write_song.
+    Files made by older versions of MIDIparse (plaintext) are read as well.
+    Arguments:
+        fd(BufferedReader): the file descriptor
+
+    Returns:
+        Song: the song read
+    """
+    data = fd.read()
+    if data[:4] != MAGIC:
+        return read_text_song(data.decode())
+    _,nbtrks,tpqn,song_duration = HEADER.unpack_from(data,0)
+    offset = HEADER.size
+    tracks = []
+    for _ in range(nbtrks):
+        channel,count = TRACK.unpack_from(data,offset)
+        offset += TRACK.size
+        track = Track(channel)
+        for name in COLUMNS:
+            column = getattr(track,name)
+            end = offset + count * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            offset = end
+        tracks.append(track)
+    return Song(tpqn,song_duration,tracks)
+
+
+def format_event(event):
+    """ gives the plaintext line of an instruction
+    Arguments:
+        event(tuple): the instruction
+
+    Returns:
+        str: the line describing the instruction
+    """
+    starttime,kind,a,b,value = event
+    match kind:
+        case 0: # AFTERTOUCH
+            return f"starttime {starttime}, Aftertouch, key_note {a}, velocity {b}"
+        case 1: # BANK_SELECT
+            return f"starttime {starttime}, BankSelect, bank {value}"
+        case 2: # CHANNEL_AFTERTOUCH
+            return f"starttime {starttime}, Channel Aftertouch, pressure_value {a}"
+        case 3: # CONTROL_CHANGE
+            return f"starttime {starttime}, ControlChange, key_note {a}, velocity {b}"
+        case 4: # INSTR_CHANGE
+            return f"starttime {starttime}, InstrChange, controller_number {a}"
+        case 5: # LOOP_POINT
+            return f"starttime {starttime}, LoopPoint, "
+        case 6: # META_MESSAGE
+            data = hex(value) if 0x01 <= a <= 0x07 else value
+            return f"starttime {starttime}, MetaMessage, type {META_EVENTS.get(a,'unknown')}, data {data}"
+        case 7: # PITCH_BEND
+            return f"starttime {starttime}, PitchBend, least_bytes {a}, most_bytes {b}"
+        case 8: # PLAY_NOTE
+            return f"starttime {starttime}, PlayNote, key_note {a}, velocity {b}, duration {value}"
+        case 9: # SYSEX
+            return f"starttime {starttime}, Sysex event, data {value}"
+
+def dump_text(fd,song):
+    """ writes a song as plaintext, one instruction per line.
+    Mostly useful for debugging: MIDIconvert reads the binary format faster.
+    Arguments:
+        fd(TextIOWrapper): the file descriptor
+        song(Song): the song to write
+    """
+    fd.write(f'ntrks {len(song.tracks)}\n')
+    fd.write(f'tpqn {song.tpqn}\n')
+    fd.write(f'song_duration {song.song_duration}\n')
+    for track in song.tracks:
+        fd.write('\n')
+        for event in track:
+            fd.write(format_event(event) + '\n')
+
+def parse_text_event(line):
+    """ reads a plaintext instruction line
+    Arguments:
+        line(str): the line describing the instruction
+
+    Returns:
+        tuple: the instruction
+    """
+    parts = line.rstrip('\n').split(', ')
+    starttime = int(parts[0][10:])
+    match parts[1]:
+        case "PlayNote":
+            return (starttime,PLAY_NOTE,int(parts[2][9:]),int(parts[3][9:]),int(parts[4][9:]))
+        case "Aftertouch":
+            return (starttime,AFTERTOUCH,int(parts[2][9:]),int(parts[3][9:]),0)
+        case "ControlChange":
+            return (starttime,CONTROL_CHANGE,int(parts[2][9:]),int(parts[3][9:]),0)
+        case "BankSelect":
+            return (starttime,BANK_SELECT,0,0,int(parts[2][5:]))
+        case "InstrChange":
+            return (starttime,INSTR_CHANGE,int(parts[2][18:]),0,0)
+        case "Channel Aftertouch":
+            return (starttime,CHANNEL_AFTERTOUCH,int(parts[2][15:]),0,0)
+        case "PitchBend":
+            return (starttime,PITCH_BEND,int(parts[2][12:]),int(parts[3][11:]),0)
+        case "LoopPoint":
+            return (starttime,LOOP_POINT,0,0,0)
+        case "MetaMessage":
+            meta_type = META_TYPES.get(parts[2][5:],0xFF)
+            value = int(parts[3][5:],base=0)
+            return (starttime,META_MESSAGE,meta_type,0,value if value <= 0xFFFFFFFF else 0)
+        case "Sysex event":
+            return (starttime,SYSEX,0,0,0)
+        case _:
+            print(f"parse error: {parts[1]} instruction not recognised")
+            sys.exit(1)
+
+def read_text_song(text):
+    """ reads a song written as plaintext by dump_text
+    (or by older versions of MIDIparse).
+    Arguments:
+        text(str): the content of the file
+
+    Returns:
+        Song: the song read
+    """
+    lines = text.split('\n')
+    nbtrks = int(lines[0][6:].strip())
+    tpqn = int(lines[1][5:].strip())
+    song_duration = int(lines[2][14:].strip())
+    tracks = []
+    position = 4 # the header is followed by an empty line
+    for i in range(nbtrks):
+        # channels are not written in the text format
+        track = Track(16 if i == 0 else 0xFF)
+        while position < len(lines) and lines[position] != '':
+            track.append(parse_text_event(lines[position]))
+            position += 1
+        position += 1
+        tracks.append(track)
+    return Song(tpqn,song_duration,tracks)
@@ -0,0 +1,138 @@
+import cProfile
+import time
+
+# The stages timed by the --profile option of the command line tools.
+# Profiling is disabled unless start is called: stage then gives the same
+# NullStage every time, so the hooks left in the code cost a function call.
+
+
+class NullStage:
+
+    events = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        return False
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+
+    def __init__(self,name,events):
+        self.name = name
+        self.events = events # the amount of events handled, can be set within the stage
+        self.elapsed = 0.0
+        self.excluded = 0.0 # the time spent within the stage counted by other stages
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc_info):
+        self.elapsed = time.perf_counter() - self.start - self.excluded
+        return False
+
+
+class Profiler:
+
+    def __init__(self,dump_path=None):
+        self.stages = []
+        self.start = time.perf_counter()
+        self.dump_path = dump_path # where the cProfile statistics are written (None to skip cProfile)
+        self.profile = None
+        if dump_path is not None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def report(self):
+        """ prints the time spent and the events handled in each stage,
+        and writes the cProfile statistics if asked.
+        """
+        total = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.dump_path)
+        print('')
+        print(f"{'stage':24} {'time':>10} {'share':>7} {'events':>10} {'events/s':>12}")
+        for stage in self.stages:
+            rate = f"{stage.events / stage.elapsed:12.0f}" if stage.events and stage.elapsed > 0 else f"{'':12}"
+            events = stage.events if stage.events else ''
+            print(f"{stage.name:24} {stage.elapsed:9.4f}s {100 * stage.elapsed / total:6.1f}% {events:>10} {rate}")
+        print(f"{'total':24} {total:9.4f}s")
+        if self.profile is not None:
+            print(f"cProfile statistics written to {self.dump_path} (read them with python -m pstats {self.dump_path}).")
+
+profiler = None # the profiler of the running command, None when profiling is disabled
+
+
+def add_arguments(parser):
+    """ adds the profiling options to the parser of a command line tool
+    Arguments:
+        parser(ArgumentParser): the parser of the command line
+    """
+    parser.add_argument("--profile",help="Prints the time spent and the events handled in each stage of the program.",action="store_true")
+    parser.add_argument("--profile-dump",help="Also profiles every function with cProfile and writes the statistics in the given file (implies --profile).")
+
+def start(args):
+    """ enables profiling if it was asked in the command line
+    Arguments:
+        args(Namespace): the values given as arguments in the CLI.
+    """
+    global profiler
+    if args.profile or args.profile_dump is not None:
+        profiler = Profiler(args.profile_dump)
+
+def stage(name,events=0):
+    """ times a stage of the program, as a context manager.
+    Arguments:
+        name(str): the name of the stage
+        events(int): the amount of events handled in the stage (can be set afterwards on the stage given)
+
+    Returns:
+        Stage: the stage (NULL_STAGE when profiling is disabled)
+    """
+    if profiler is None:
+        return NULL_STAGE
+    new_stage = Stage(name,events)
+    profiler.stages.append(new_stage)
+    return new_stage
+
+def batches(name,iterator,within=None):
+    """ times the reading of an iterator giving sorted batches (see MIDIparse.parse_mtrk_event),
+    as a stage of its own: the time spent reading each batch and the instructions given are summed.
+    Meant for iterators read bit by bit within another stage, as the tracks are while they are merged.
+    Arguments:
+        name(str): the name of the stage
+        iterator(iterator): the batches, as (bound, instructions)
+        within(Stage): the stage the iterator is read in, this time is not counted by it anymore
+
+    Returns:
+        iterator: the same batches (the iterator given when profiling is disabled)
+    """
+    if profiler is None:
+        return iterator
+    return timed_batches(stage(name),iterator,within)
+
+def timed_batches(batch_stage,iterator,within):
+    """ gives the batches of an iterator, timing the reading of each one (see batches) """
+    while True:
+        start = time.perf_counter()
+        try:
+            bound,batch = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            elapsed = time.perf_counter() - start
+            batch_stage.elapsed += elapsed
+            if within is not None:
+                within.excluded += elapsed
+        batch_stage.events += len(batch)
+        yield bound,batch
+
+def report():
+    """ prints the profiling report, if profiling is enabled """
+    if profiler is not None:
+        profiler.report()
@@ -0,0 +1,330 @@
+import argparse
+import sys
+import time
+
+# Fixed duration pauses (0x80 to 0x8F), by duration
+FIXED_PAUSES = {96: 0x80, 72: 0x81, 64: 0x82, 48: 0x83, 36: 0x84, 32: 0x85, 24: 0x86, 18: 0x87,
+    16: 0x88, 12: 0x89, 9: 0x8A, 8: 0x8B, 6: 0x8C, 4: 0x8D, 3: 0x8E, 2: 0x8F}
+FIXED_DURATIONS = {opcode: duration for duration,opcode in FIXED_PAUSES.items()}
+MAX_PAUSE = 0xFFFFFF # longest pause of a single Pause24Bits
+
+# The events decoded from an SMD track.
+# Each event is a tuple (tick, kind, a, b, value), tick being the time at which it happens:
+# - Note: a = MIDI key note, b = velocity, value = duration
+# - Pause: value = duration
+# - Octave: a = the new track octave (SetTrackOctave or AddToTrackOctave)
+# - Tempo: a = BPM
+# - Program: a = preset ID in the SWD file
+# - Swdl / Bank: a = value (the link bytes, needed upon a program change)
+# - Volume / Expression / Pan: a = value
+# - PitchBend: a = first byte, b = second byte
+# - LoopPoint, EndOfTrack: no parameters
+# - Other: a = opcode, value = its parameters (big endian)
+NOTE = 0
+PAUSE = 1
+OCTAVE = 2
+TEMPO = 3
+PROGRAM = 4
+SWDL = 5
+BANK = 6
+VOLUME = 7
+EXPRESSION = 8
+PAN = 9
+PITCH_BEND = 10
+LOOP_POINT = 11
+END_OF_TRACK = 12
+OTHER = 13
+
+KIND_NAMES = ("Note","Pause","Octave","Tempo","Program","Swdl","Bank","Volume",
+    "Expression","Pan","PitchBend","LoopPoint","EndOfTrack","Other")
+
+# events taking a single parameter, by opcode
+SINGLE_PARAMETER = {0xA4: TEMPO, 0xA5: TEMPO, 0xA9: SWDL, 0xAA: BANK, 0xAC: PROGRAM,
+    0xE0: VOLUME, 0xE3: EXPRESSION, 0xE8: PAN}
+# amount of parameters of the other events found in the games, by opcode
+# (an opcode missing here is unknown: it is read as an event without parameters, as MIDIconvert always did)
+OTHER_PARAMETERS = {
+    0x95: 1, 0x9C: 1, 0x9D: 1, 0x9E: 1, 0xA8: 2, 0xAB: 0, 0xAF: 3, 0xB0: 0,
+    0xB1: 1, 0xB2: 1, 0xB3: 1, 0xB4: 2, 0xB5: 1, 0xB6: 1, 0xBC: 1, 0xBE: 2,
+    0xBF: 1, 0xC0: 1, 0xC3: 1, 0xCB: 0, 0xD0: 2, 0xD1: 1, 0xD2: 1, 0xD3: 2,
+    0xD4: 3, 0xD5: 2, 0xD6: 2, 0xD8: 2, 0xDB: 1, 0xDC: 5, 0xDD: 4, 0xDF: 1,
+    0xE1: 1, 0xE2: 3, 0xE4: 5, 0xE5: 4, 0xE7: 1, 0xE9: 1, 0xEA: 3, 0xEC: 5,
+    0xED: 4, 0xEF: 1, 0xF0: 5, 0xF1: 4, 0xF2: 2, 0xF3: 3, 0xF6: 1, 0xF8: 0
+}
+
+
+class TrackReader:
+
+    def __init__(self):
+        self.tick = 0 # the time reached in the track
+        self.last_pause = 0 # the duration of the last pause
+        self.last_duration = 0 # the duration of the last note (reused by notes without one)
+        self.octave = 4 # the track octave
+        self.events = []
+        self.ended = False
+
+def read_note(reader,data,position):
+    """ reads a PlayNote event: the opcode is the velocity,
+    followed by the note, the octave shift and the amount of duration bytes.
+    Arguments:
+        reader(TrackReader): the state of the track
+        data(memoryview): the content of the file
+        position(int): the position of the event
+
+    Returns:
+        int: the position of the next event
+    """
+    note_data = data[position + 1]
+    nb_param = note_data >> 6
+    reader.octave += ((note_data >> 4) & 0x3) - 2
+    if nb_param > 0:
+        reader.last_duration = int.from_bytes(data[position + 2:position + 2 + nb_param],'big')
+    reader.events.append((reader.tick,NOTE,reader.octave * 12 + (note_data & 0xF),data[position],reader.last_duration))
+    return position + 2 + nb_param
+
+def read_fixed_pause(reader,data,position):
+    """ reads a fixed duration pause (0x80 to 0x8F)
+    Arguments:
+        reader(TrackReader): the state of the track
+        data(memoryview): the content of the file
+        position(int): the position of the event
+
+    Returns:
+        int: the position of the next event
+    """
+    return wait(reader,FIXED_DURATIONS[data[position]],position + 1)
+
+def read_repeat_pause(reader,data,position):
+    """ reads a RepeatLastPause (0x90) """
+    return wait(reader,reader.last_pause,position + 1)
+
+def read_add_pause(reader,data,position):
+    """ reads an AddToLastPause (0x91) """
+    return wait(reader,reader.last_pause + data[position + 1],position + 2)
+
+def read_pause(reader,data,position):
+    """ reads a Pause8Bits, Pause16Bits or Pause24Bits (0x92 to 0x94) """
+    size = data[position] - 0x91
+    return wait(reader,int.from_bytes(data[position + 1:position + 1 + size],'little'),position + 1 + size)
+
+def wait(reader,duration,position):
+    """ adds a pause to the track
+    Arguments:
+        reader(TrackReader): the state of the track
+        duration(int): the duration of the pause
+        position(int): the position of the next event
+
+    Returns:
+        int: the position of the next event
+    """
+    reader.events.append((reader.tick,PAUSE,0,0,duration))
+    reader.tick += duration
+    reader.last_pause = duration
+    return position
+
+def read_end(reader,data,position):
+    """ reads an EndOfTrack (0x98) """
+    reader.events.append((reader.tick,END_OF_TRACK,0,0,0))
+    reader.ended = True
+    return position + 1
+
+def read_loop_point(reader,data,position):
+    """ reads a LoopPoint (0x99) """
+    reader.events.append((reader.tick,LOOP_POINT,0,0,0))
+    return position + 1
+
+def read_set_octave(reader,data,position):
+    """ reads a SetTrackOctave (0xA0) """
+    reader.octave = data[position + 1]
+    reader.events.append((reader.tick,OCTAVE,reader.octave,0,0))
+    return position + 2
+
+def read_add_octave(reader,data,position):
+    """ reads an AddToTrackOctave (0xA1), its parameter is signed """
+    shift = data[position + 1]
+    reader.octave += shift - 256 if shift >= 0x80 else shift
+    reader.events.append((reader.tick,OCTAVE,reader.octave,0,0))
+    return position + 2
+
+def read_single_parameter(reader,data,position):
+    """ reads an event of a single parameter (see SINGLE_PARAMETER) """
+    reader.events.append((reader.tick,SINGLE_PARAMETER[data[position]],data[position + 1],0,0))
+    return position + 2
+
+def read_pitch_bend(reader,data,position):
+    """ reads a PitchBend (0xD7) """
+    reader.events.append((reader.tick,PITCH_BEND,data[position + 1],data[position + 2],0))
+    return position + 3
+
+def read_other(reader,data,position):
+    """ reads an event not interpreted here (see OTHER_PARAMETERS) """
+    opcode = data[position]
+    nb_param = OTHER_PARAMETERS.get(opcode,0)
+    value = int.from_bytes(data[position + 1:position + 1 + nb_param],'big')
+    reader.events.append((reader.tick,OTHER,opcode,0,value))
+    return position + 1 + nb_param
+
+# the function reading each opcode
+OPCODES = [read_other] * 256
+OPCODES[0x00:0x80] = [read_note] * 0x80
+OPCODES[0x80:0x90] = [read_fixed_pause] * 0x10
+OPCODES[0x90] = read_repeat_pause
+OPCODES[0x91] = read_add_pause
+OPCODES[0x92:0x95] = [read_pause] * 3
+OPCODES[0x98] = read_end
+OPCODES[0x99] = read_loop_point
+OPCODES[0xA0] = read_set_octave
+OPCODES[0xA1] = read_add_octave
+OPCODES[0xD7] = read_pitch_bend
+for opcode in SINGLE_PARAMETER:
+    OPCODES[opcode] = read_single_parameter
+
+
+class SMDTrack:
+
+    def __init__(self,track_id,channel,events):
+        self.track_id = track_id
+        self.channel = channel
+        self.events = events # the events of the track, see NOTE to OTHER
+
+    def duration(self):
+        """ Gives the time at which the last event of the track happens.
+        Returns:
+            int: the time (in ticks)
+        """
+        return self.events[-1][0] if self.events else 0
+
+class SMDFile:
+
+    def __init__(self,tpqn,link_byte,tracks):
+        self.tpqn = tpqn
+        self.link_byte = link_byte # as written in the header
+        self.tracks = tracks
+
+
+def decode_track(data,start,end):
+    """ decodes the events of a track
+    Arguments:
+        data(memoryview): the content of the file
+        start(int): the position of the first event
+        end(int): the end of the track chunk
+
+    Returns:
+        list: the events of the track
+    """
+    reader = TrackReader()
+    data = data[:end] # an event running past the end of the track cannot be read
+    position = start
+    try:
+        while position < end and not reader.ended:
+            event_position = position
+            position = OPCODES[data[position]](reader,data,position)
+    except IndexError:
+        raise ValueError(f"truncated event at {event_position:#x}") from None
+    if position > end: # the slice of its duration or parameters was cut short
+        raise ValueError(f"truncated event at {event_position:#x}")
+    return reader.events
+
+def decode_smd(data):
+    """ decodes an SMD file: its header, song chunk and tracks.
+    Arguments:
+        data(bytes): the content of the file
+
+    Returns:
+        SMDFile: the song decoded
+    """
+    data = memoryview(data)
+    if data[0:4] != b'smdl':
+        raise ValueError(f"the magic number read indicates the file is not of .smd format. Found: {bytes(data[0:4])}")
+    if len(data) < 0x80:
+        raise ValueError("the file ends before the end of its header")
+    link_byte = int.from_bytes(data[0x0E:0x10],'big')
+    if data[0x40:0x44] != b'song':
+        raise ValueError("the song chunk starts with a wrong magic number")
+    tpqn = int.from_bytes(data[0x52:0x54],'little')
+    nb_tracks = data[0x56]
+    tracks = []
+    offset = 0x80
+    for _ in range(nb_tracks):
+        if data[offset:offset + 4] != b'trk ':
+            raise ValueError(f"a track chunk starts with a wrong magic number at {offset:#x}")
+        length = int.from_bytes(data[offset + 12:offset + 16],'little')
+        end = offset + 16 + length
+        if end > len(data):
+            raise ValueError(f"the track chunk at {offset:#x} goes past the end of the file")
+        if length < 4:
+            raise ValueError(f"the track chunk at {offset:#x} is too short to hold its track header")
+        events = decode_track(data,offset + 20,end)
+        tracks.append(SMDTrack(data[offset + 16],data[offset + 17],events))
+        offset = end + (-end) % 4 # the chunks are padded to 4 bytes
+    return SMDFile(tpqn,link_byte,tracks)
+
+def format_event(event):
+    """ gives the plaintext line of an event
+    Arguments:
+        event(tuple): the event
+
+    Returns:
+        str: the line describing the event
+    """
+    tick,kind,a,b,value = event
+    match kind:
+        case 0: # NOTE
+            return f"{tick:8d} Note key {a} velocity {b} duration {value}"
+        case 1: # PAUSE
+            return f"{tick:8d} Pause {value}"
+        case 10: # PITCH_BEND
+            return f"{tick:8d} PitchBend {a:#04x} {b:#04x}"
+        case 11 | 12: # LOOP_POINT, END_OF_TRACK
+            return f"{tick:8d} {KIND_NAMES[kind]}"
+        case 13: # OTHER
+            return f"{tick:8d} Other opcode {a:#04x} parameters {value:#x}"
+        case _:
+            return f"{tick:8d} {KIND_NAMES[kind]} {a}"
+
+def parse_args():
+    """ creates the parser of the command line
+
+    Returns:
+        Namespace: the values given as arguments in the CLI.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog = "smd",
+        description="Disassembles SMD files."
+    )
+
+    parser.add_argument("files",help="The SMD files to read.",nargs="+")
+    parser.add_argument("--summary",help="Only prints the amount of tracks and events of each file, and the time spent.",action="store_true")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    nb_events = 0
+    for file_name in args.files:
+        try:
+            with open(file_name,'rb') as file:
+                song = decode_smd(file.read())
+        except FileNotFoundError:
+            print(f"File {file_name} is not found")
+            sys.exit(1)
+        except ValueError as e:
+            print(f"parse error in {file_name}: {e}")
+            sys.exit(1)
+        count = sum(len(track.events) for track in song.tracks)
+        nb_events += count
+        if args.summary:
+            print(f"{file_name}: {len(song.tracks)} tracks, {count} events")
+            continue
+        print(f"{file_name}: tpqn {song.tpqn}, link byte {song.link_byte:04x}")
+        for track in song.tracks:
+            print(f"track {track.track_id} (channel {track.channel})")
+            for event in track.events:
+                print(format_event(event))
+    elapsed = time.perf_counter() - start
+    if args.summary:
+        print(f"{len(args.files)} files, {nb_events} events decoded in {elapsed:.3f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import mmap
+import os
+import struct
+
+# The presets and samples fetched by PresetFetcher, packed in a single file.
+# Layout (little endian):
+# - header: magic, amount of presets, amount of samples
+# - preset index: for each preset, the length of its name, its name (utf-8), offset and length of its data
+# - sample index: for each sample, its ID, offset and length of its data
+# - the data of every preset and sample, one after the other
+# Offsets are counted from the start of the file.
+STORE_PATH = 'PRESETS/store.pak'
+MAGIC = b'TRZS'
+HEADER = struct.Struct('<4sII')
+ENTRY = struct.Struct('<II') # offset, length
+SAMPLE_ENTRY = struct.Struct('<HII') # ID, offset, length
+
+
+def write_store(path,presets,samples):
+    """ Packs presets and samples in a single store file.
+    Arguments:
+        path(str): the path of the store to write
+        presets(dict): the data of each preset, by name
+        samples(dict): the data of each sample, by ID
+    """
+    names = [name.encode() for name in presets]
+    index_size = HEADER.size
+    index_size += sum(1 + len(name) + ENTRY.size for name in names)
+    index_size += SAMPLE_ENTRY.size * len(samples)
+    index = bytearray(HEADER.pack(MAGIC,len(presets),len(samples)))
+    offset = index_size
+    for name,data in zip(names,presets.values()):
+        index.append(len(name))
+        index += name
+        index += ENTRY.pack(offset,len(data))
+        offset += len(data)
+    for sample_id,data in samples.items():
+        index += SAMPLE_ENTRY.pack(sample_id,offset,len(data))
+        offset += len(data)
+    # written aside then renamed: an interrupted write keeps the previous store
+    # (which must be closed first, a mapped file cannot be replaced on Windows)
+    with open(path + '.tmp','wb') as output:
+        output.write(index)
+        for data in presets.values():
+            output.write(data)
+        for data in samples.values():
+            output.write(data)
+    os.replace(path + '.tmp',path)
+
+def read_loose_file(path):
+    """ Reads a preset or sample stored in its own file.
+    Arguments:
+        path(str): the path of the file
+
+    Returns:
+        bytes: the content of the file (None if the file does not exist)
+    """
+    try:
+        with open(path,'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+class SoundStore:
+
+    def __init__(self,path=STORE_PATH):
+        self.presets = {} # name -> (offset, length)
+        self.samples = {} # ID -> (offset, length)
+        self.data = b''
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path,'rb') as file:
+                self.data = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+            self.read_index()
+
+    def read_index(self):
+        magic,nb_presets,nb_samples = HEADER.unpack_from(self.data,0)
+        if magic != MAGIC:
+            print(f'store error: {STORE_PATH} is not a preset store, the PRESETS and SAMPLES directories are used instead.')
+            self.data = b''
+            return
+        position = HEADER.size
+        for _ in range(nb_presets):
+            name_length = self.data[position]
+            name = self.data[position + 1:position + 1 + name_length].decode()
+            position += 1 + name_length
+            self.presets[name] = ENTRY.unpack_from(self.data,position)
+            position += ENTRY.size
+        for _ in range(nb_samples):
+            sample_id,offset,length = SAMPLE_ENTRY.unpack_from(self.data,position)
+            self.samples[sample_id] = (offset,length)
+            position += SAMPLE_ENTRY.size
+
+    def preset(self,name):
+        """ Gives the data of a preset (its ID included)
+        Presets missing from the store are read from the PRESETS directory.
+        Arguments:
+            name(str): the name of the preset
+
+        Returns:
+            bytes: the data of the preset (None if the preset is unavailable)
+        """
+        entry = self.presets.get(name)
+        if entry is None:
+            return read_loose_file(f'PRESETS/{name}.bin')
+        offset,length = entry
+        return self.data[offset:offset + length]
+
+    def sample(self,sample_id):
+        """ Gives the data of a sample
+        Samples missing from the store are read from the SAMPLES directory.
+        Arguments:
+            sample_id(int): the ID of the sample
+
+        Returns:
+            bytes: the data of the sample (None if the sample is unavailable)
+        """
+        entry = self.samples.get(sample_id)
+        if entry is None:
+            return read_loose_file(f'SAMPLES/{sample_id}.bin')
+        offset,length = entry
+        return self.data[offset:offset + length]
+
+    def close(self):
+        """ Closes the store: its file can be replaced once no process maps it.
+        The presets and samples are then read from the PRESETS and SAMPLES directories.
+        """
+        if isinstance(self.data,mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self.presets = {}
+        self.samples = {}
+
+    def prefetch(self):
+        """ Reads the store ahead of its use: the system is asked to load it
+        in the background where it can, the store is read through once otherwise.
+        """
+        if isinstance(self.data,mmap.mmap) and hasattr(mmap,'MADV_WILLNEED'):
+            self.data.madvise(mmap.MADV_WILLNEED)
+        else:
+            for offset in range(0,len(self.data),mmap.PAGESIZE):
+                self.data[offset]
+
+
+_store = None
+
+def get_store():
+    """ Gives the store of the PRESETS directory, opened once per process.
+    Returns:
+        SoundStore: the store
+    """
+    global _store
+    if _store is None:
+        _store = SoundStore()
+    return _store
+
+def reopen_store():
+    """ Closes the store of the process: the next get_store opens it again
+    (once PresetFetcher replaced it, or fetched presets to the PRESETS directory).
+    """
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
+def prefetch_store():
+    """ Opens the store of the process and reads it ahead of its use
+    (given as initializer to the pools of processes converting files).
+    """
+    get_store().prefetch()
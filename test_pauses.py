@@ -0,0 +1,98 @@
+import random
+import unittest
+
+import MIDIconvert
+import events
+import smd
+
+def decode(data,last_pause=-1):
+    """ decodes pause events with the SMD decoder, as the sequencer reads them
+    Arguments:
+        data(bytes): the pause events
+        last_pause(int): the duration of the last pause made before them (-1 if unknown)
+
+    Returns:
+        int: the total duration waited
+        int: the duration of the last pause made (last_pause if there is no event)
+    """
+    reader = smd.TrackReader()
+    reader.last_pause = last_pause
+    position = 0
+    while position < len(data):
+        position = smd.OPCODES[data[position]](reader,data,position)
+    return reader.tick,reader.last_pause
+
+def repeats_unknown_pause(data):
+    """ tells if pause events use the last pause before setting it
+    Arguments:
+        data(bytes): the pause events
+
+    Returns:
+        bool: True if the first event is a RepeatLastPause or an AddToLastPause
+    """
+    return len(data) > 0 and data[0] in (0x90,0x91)
+
+
+class EncodePauseTest(unittest.TestCase):
+
+    def assert_waits(self,length,last_pause):
+        data,new_last_pause = MIDIconvert.encode_pause(length,last_pause)
+        self.assertEqual(decode(data,last_pause),(length,new_last_pause),f"{length} ticks after {last_pause}: {data.hex()}")
+        return data
+
+    def test_no_pause(self):
+        for last_pause in (-1,0,48,1000):
+            self.assertEqual(MIDIconvert.encode_pause(0,last_pause),(b'',last_pause))
+
+    def test_fixed_pauses(self):
+        for duration,opcode in smd.FIXED_PAUSES.items():
+            for last_pause in (-1,duration,duration + 1):
+                self.assertEqual(self.assert_waits(duration,last_pause),bytes([opcode]))
+
+    def test_repeat_last_pause(self):
+        self.assertEqual(self.assert_waits(1000,1000),b'\x90')
+
+    def test_add_to_last_pause(self):
+        self.assertEqual(self.assert_waits(1100,1000),b'\x91\x64')
+        self.assertEqual(self.assert_waits(1000 + 0xFF,1000),b'\x91\xFF')
+        for length in range(1001,1000 + 0x100):
+            self.assertLessEqual(len(self.assert_waits(length,1000)),2)
+
+    def test_24_bits_boundary(self):
+        for length in (0xFFFF,0x10000,smd.MAX_PAUSE - 1,smd.MAX_PAUSE,smd.MAX_PAUSE + 1,
+                       smd.MAX_PAUSE + 96,2 * smd.MAX_PAUSE,2 * smd.MAX_PAUSE + 1,5 * smd.MAX_PAUSE + 12345):
+            for last_pause in (-1,96,smd.MAX_PAUSE):
+                data = self.assert_waits(length,last_pause)
+                if length <= smd.MAX_PAUSE:
+                    self.assertLessEqual(len(data),4)
+
+    def test_unknown_last_pause(self):
+        # after a LoopPoint, the last pause is unknown: the song may loop back from any pause
+        for length in list(range(1,600)) + [1000,0xFFFF,smd.MAX_PAUSE,smd.MAX_PAUSE + 7,3 * smd.MAX_PAUSE + 1]:
+            data,_ = MIDIconvert.encode_pause(length,-1)
+            self.assertFalse(repeats_unknown_pause(data),f"{length} ticks: {data.hex()}")
+            for looped_pause in (0,1,96,5000):
+                self.assertEqual(decode(data,looped_pause)[0],length)
+
+    def test_loop_point_in_track(self):
+        song = events.Song(48,500,[events.Track(16)])
+        track = song.tracks[0]
+        track.append((250,events.LOOP_POINT,0,0,0))
+        track.append((500,events.LOOP_POINT,0,0,0))
+        data = MIDIconvert.encode_track(track,0,'0000',MIDIconvert.ProgramRegistry(False),song.song_duration)
+        track_events = data[20:data.index(b'\x98',20)]
+        # the same wait before and after the first LoopPoint: it is not repeated across it
+        first_loop = track_events.index(b'\x99')
+        self.assertFalse(repeats_unknown_pause(track_events[first_loop + 1:]))
+        self.assertEqual(decode(track_events[:first_loop])[0],250)
+
+    def test_random_waits(self):
+        rand = random.Random(0)
+        last_pause = -1
+        for _ in range(5000):
+            length = rand.choice((rand.randrange(1,300),rand.randrange(1,70000),rand.randrange(1,1 << 26)))
+            data = self.assert_waits(length,last_pause)
+            last_pause = decode(data,last_pause)[1]
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import unittest
+
+import MIDIconvert
+import events
+import smd
+
+def make_smd():
+    """ converts a short song of two channels
+    Returns:
+        bytes: the SMD file made
+    """
+    tempo = events.Track(16)
+    tempo.append((0,events.META_MESSAGE,0x51,0,500000))
+    tracks = [tempo]
+    for channel in (0,1):
+        track = events.Track(channel)
+        track.append((0,events.INSTR_CHANGE,channel,0,0))
+        for i in range(40):
+            track.append((i * 48,events.PLAY_NOTE,40 + i % 30 + channel,100,24 + i * 7))
+        tracks.append(track)
+    song = events.Song(48,40 * 48 + 300,tracks)
+    with contextlib.redirect_stdout(io.StringIO()): # MIDIconvert prints every track
+        data,_ = MIDIconvert.convert_song(song,"0000",False)
+    return data
+
+
+class DecodeSMDTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = make_smd()
+
+    def test_decode(self):
+        song = smd.decode_smd(self.data)
+        self.assertEqual(len(song.tracks),3)
+        notes = [event for event in song.tracks[1].events if event[1] == smd.NOTE]
+        self.assertEqual(len(notes),40)
+
+    def track_chunks(self):
+        """ lists the track chunks of the file
+        Returns:
+            list: the position of the first event and the end of each track chunk
+        """
+        chunks = []
+        offset = 0x80
+        while self.data[offset:offset + 4] == b'trk ':
+            end = offset + 16 + int.from_bytes(self.data[offset + 12:offset + 16],'little')
+            chunks.append((offset + 20,end))
+            offset = end + (-end) % 4
+        return chunks
+
+    def test_truncated_file(self):
+        # the end of chunk after the tracks is not read
+        for size in range(self.track_chunks()[-1][1]):
+            with self.assertRaises(ValueError,msg=f"cut at {size:#x}"):
+                smd.decode_smd(self.data[:size])
+
+    def test_truncated_track(self):
+        data = memoryview(self.data)
+        truncated = 0
+        for start,end in self.track_chunks():
+            for cut in range(start,end):
+                try:
+                    smd.decode_track(data,start,cut)
+                except ValueError as e: # a cut between two events is still a valid track
+                    self.assertIn("truncated event",str(e))
+                    truncated += 1
+        self.assertGreater(truncated,0)
+
+if __name__ == "__main__":
+    unittest.main()